@@ -0,0 +1,157 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import *
+
+# the partition is sampled in this many evenly spaced chunks
+SAMPLE_CHUNKS = 32
+SAMPLE_CHUNK_BYTES = 1024 * 1024
+# bytes written, & synced, to the backup directory to estimate its write speed
+WRITE_PROBE_BYTES = 16 * 1024 * 1024
+
+# compressors used by apart-core for each compression option, reading stdin & writing stdout
+COMPRESS_COMMANDS = {'gz': ['pigz', '-c'],
+                     'lz4': ['lz4', '-c'],
+                     'zst': ['zstd', '-c']}
+THREAD_FLAGS = {'gz': '-p', 'zst': '-T'}
+
+
+def compress_command(z_option: str, z_settings: Dict[str, int] = None) -> List[str]:
+    """
+    :param z_settings: compression_level & compression_threads, missing => compressor default
+
+    >>> compress_command('zst', {'compression_level': 19, 'compression_threads': 32})
+    ['zstd', '-c', '-19', '-T32']
+    >>> compress_command('gz', {'compression_threads': 4})
+    ['pigz', '-c', '-p4']
+    >>> compress_command('lz4')
+    ['lz4', '-c']
+    """
+    z_settings = z_settings or {}
+    command = list(COMPRESS_COMMANDS[z_option])
+    if z_settings.get('compression_level'):
+        command.append('-{}'.format(z_settings['compression_level']))
+    if z_settings.get('compression_threads') and z_option in THREAD_FLAGS:
+        command.append('{}{}'.format(THREAD_FLAGS[z_option], z_settings['compression_threads']))
+    return command
+
+
+class Advice:
+    """Measured & predicted performance of a compression option for a partition"""
+    def __init__(self, z_option: str, ratio: float, compress_rate: float, predicted_seconds: float):
+        self.z_option = z_option
+        self.ratio = ratio  # image bytes / partition bytes
+        self.compress_rate = compress_rate  # partition bytes/second, inf when uncompressed
+        self.predicted_seconds = predicted_seconds
+
+    def __repr__(self):
+        return 'Advice({}, ratio={:.2f}, {:.0f}s)'.format(self.z_option, self.ratio, self.predicted_seconds)
+
+
+def predicted_seconds(size: int, ratio: float, compress_rate: float, write_rate: Optional[float]) -> float:
+    """
+    Compression & writing run as a pipeline, so the slower of the two bounds the clone time
+
+    >>> predicted_seconds(1000, ratio=0.5, compress_rate=100, write_rate=40)
+    12.5
+    >>> predicted_seconds(1000, ratio=0.5, compress_rate=50, write_rate=None)
+    20.0
+    """
+    rate = compress_rate
+    if write_rate:
+        rate = min(rate, write_rate / ratio)
+    return size / rate
+
+
+def can_read(device: str) -> bool:
+    """False => sampling runs this module through pkexec, as apart-gtk usually runs unprivileged"""
+    return os.access(device, os.R_OK)
+
+
+def read_sample(device: str, size: int) -> bytes:
+    """:return: evenly spaced chunks of the device, read as root via pkexec when this process can't"""
+    if can_read(device):
+        return read_device_sample(device, size)
+    result = subprocess.run(['pkexec', sys.executable, os.path.realpath(__file__), device, str(size)],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode:
+        raise OSError('Reading {} as root was not authorized'.format(device))
+    return result.stdout
+
+
+def read_device_sample(device: str, size: int) -> bytes:
+    """:return: evenly spaced chunks of the device, raises OSError without read access"""
+    chunks = []
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        step = max(SAMPLE_CHUNK_BYTES, size // SAMPLE_CHUNKS)
+        for offset in range(0, max(size - SAMPLE_CHUNK_BYTES, 0) + 1, step):
+            chunks.append(os.pread(fd, SAMPLE_CHUNK_BYTES, offset))
+            if len(chunks) == SAMPLE_CHUNKS:
+                break
+    finally:
+        os.close(fd)
+    return b''.join(chunks)
+
+
+def measure_compression(z_option: str, sample: bytes, z_settings: Dict[str, int] = None) -> Tuple[float, float]:
+    """:return: (image bytes / sample bytes, sample bytes/second) raises OSError if unavailable"""
+    if z_option == 'uncompressed':
+        return 1.0, float('inf')
+    start = time.perf_counter()
+    result = subprocess.run(compress_command(z_option, z_settings), input=sample, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, check=True)
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    return len(result.stdout) / len(sample), len(sample) / elapsed
+
+
+def measure_write_rate(directory: str) -> float:
+    """:return: bytes/second of writing & syncing incompressible data to the directory"""
+    data = os.urandom(WRITE_PROBE_BYTES)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.apart-write-probe-') as file:
+        start = time.perf_counter()
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+        elapsed = max(time.perf_counter() - start, 1e-6)
+    return len(data) / elapsed
+
+
+def advise(device: str, size: int, z_options: List[str], directory: str = None,
+           z_settings: Dict[str, Dict[str, int]] = None) -> List[Advice]:
+    """
+    :param z_settings: compression level & threads by compression option, missing => defaults
+    Benchmark each compression option on a sample of the partition, note blocks while reading,
+    compressing & writing so must not be called on the main thread.
+    Compressors run one after another, as they are multi-threaded & would skew each other's rates
+    :return: advice for each measurable option, fastest predicted clone first
+    :raises OSError: partition cannot be read, ie root access via pkexec was refused
+    """
+    sample = read_sample(device, size)
+    if not sample:
+        raise OSError('Partition {} is empty'.format(device))
+    write_rate = None
+    if directory:
+        try:
+            write_rate = measure_write_rate(directory)
+        except OSError:
+            pass
+
+    advice = []
+    for z_option in z_options:
+        if z_option == 'uncompressed' and not write_rate:
+            continue  # unbounded without knowing how fast the image can be written
+        try:
+            ratio, compress_rate = measure_compression(z_option, sample, (z_settings or {}).get(z_option))
+        except (OSError, KeyError, subprocess.CalledProcessError):
+            continue
+        advice.append(Advice(z_option, ratio, compress_rate,
+                             predicted_seconds(size, ratio, compress_rate, write_rate)))
+    return sorted(advice, key=lambda a: a.predicted_seconds)
+
+
+if __name__ == '__main__':
+    # pkexec helper of read_sample: advisor.py <device> <size>, writes the sample to stdout
+    sys.stdout.buffer.write(read_device_sample(sys.argv[1], int(sys.argv[2])))
@@ -1,26 +1,90 @@
 import uuid
+import json
+import weakref
 import yaml
 import subprocess
 import sys
 import os
 import zmq
-from threading import Thread
+from datetime import timezone
+from threading import Lock, Thread
 from typing import *
-from util import default_datetime_to_utc
+from util import parse_timestamps
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # True: print out messages <--> core
 LOG_MESSAGES = False
 
+# message keys listeners may be indexed by in addition to 'type', see MessageListener.match
+INDEXED_KEYS = ('id', 'file')
+
+
+class MessageLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """Safe yaml loader, using libyaml when available, that produces tz-aware timestamps"""
+    def construct_utc_timestamp(self, node):
+        timestamp = self.construct_yaml_timestamp(node)
+        if timestamp.tzinfo is None:  # older pyyaml ignores yaml datetime 'Z' endings
+            return timestamp.replace(tzinfo=timezone.utc)
+        return timestamp
+
+
+MessageLoader.add_constructor('tag:yaml.org,2002:timestamp', MessageLoader.construct_utc_timestamp)
+
+
+def wire_encodings() -> List[str]:
+    """:return: encodings this client can decode, in order of preference"""
+    if msgpack:
+        return ['msgpack', 'json', 'yaml']
+    return ['json', 'yaml']
+
+
+def decode_message(data: bytes) -> Dict:
+    """
+    Decode a message from apart-core, which may be yaml or a negotiated json/msgpack encoding
+
+    >>> decode_message(b'type: clone\\nstart: 2017-05-03T10:20:30Z')
+    {'type': 'clone', 'start': datetime.datetime(2017, 5, 3, 10, 20, 30, tzinfo=datetime.timezone.utc)}
+
+    >>> decode_message(b'{"type": "clone", "start": "2017-05-03T10:20:30Z", "complete": 0.5}')
+    {'type': 'clone', 'start': datetime.datetime(2017, 5, 3, 10, 20, 30, tzinfo=datetime.timezone.utc), \
+'complete': 0.5}
+    """
+    first = data[:1]
+    if first == b'{':
+        return json.loads(data.decode(), object_hook=parse_timestamps)
+    if msgpack and first and (0x80 <= first[0] <= 0x8f or first[0] in [0xde, 0xdf]):
+        return msgpack.unpackb(data, raw=False, object_hook=parse_timestamps)
+    return yaml.load(data, Loader=MessageLoader)
+
 
 class MessageListener:
     def __init__(self, on_message: Callable[[Dict], None],
                  message_predicate: Callable[[Dict], bool] = lambda m: True,
                  listen_to: 'ApartCore' = None,
-                 one_time: bool = False):
+                 one_time: bool = False,
+                 message_types: Iterable[str] = None,
+                 match: Dict[str, Any] = None,
+                 weak: bool = False):
+        """
+        :param message_types: only receive messages of these types, None => all types
+        :param match: only receive messages with these values, ie {'file': '/mnt/a.apt.dd.gz'},
+                      listeners are indexed by the first of INDEXED_KEYS present
+        :param weak: True => on_message, a bound method, is weakly referenced so the listener
+                     won't keep its object alive, and stops listening once the object is gone
+        """
         self.one_time = one_time
-        self.input_on_message = on_message
+        if weak:
+            self.input_on_message = weakref.WeakMethod(on_message)
+        else:
+            self.input_on_message = lambda: on_message
 
         self.message_predicate = message_predicate
+        self.message_types = frozenset(message_types) if message_types else None
+        self.match = match or {}
         self.remove_fn = None
         if listen_to:
             self.listen_to(listen_to)
@@ -32,18 +96,59 @@ class MessageListener:
     def stop_listening(self) -> 'MessageListener':
         if self.remove_fn is not None:
             self.remove_fn()
+            self.remove_fn = None
         return self
 
+    def index_keys(self) -> List[Tuple]:
+        """:return: dispatch index keys this listener is registered under, see ApartCore.dispatch"""
+        types = self.message_types or [None]
+        for key in INDEXED_KEYS:
+            if key in self.match:
+                return [(msg_type, key, self.match[key]) for msg_type in types]
+        return [(msg_type,) for msg_type in types]
+
+    def matches(self, msg: Dict) -> bool:
+        for key, val in self.match.items():
+            if msg.get(key) != val:
+                return False
+        return self.message_predicate(msg)
+
     def on_message(self, msg: Dict) -> bool:
         """Return False implies stop listening"""
-        self.input_on_message(msg)
+        on_message = self.input_on_message()
+        if on_message is None:
+            return False
+        on_message(msg)
         return not self.one_time
 
 
+def main_loop_handler(on_message: Callable[[Dict], Any]) -> Callable[[Dict], None]:
+    """
+    Wrap a message handler so it runs in the GLib main loop, directly when messages are already
+    being dispatched there or otherwise via GLib.idle_add
+    """
+    from gi.repository import GLib
+
+    def handle(msg: Dict):
+        if GLib.MainContext.default().is_owner():
+            on_message(msg)
+        else:
+            GLib.idle_add(on_message, msg)
+    return handle
+
+
 class ApartCore(Thread):
+    # optional clone request keys the core advertises in its started status, ie compression_level
+    clone_options = frozenset()
+
     def __init__(self, listeners: List[MessageListener] = None,
-                 on_finish: Callable[[int], None] = lambda return_code: None):
-        """Starts an apart-core command and starts listening for zmq messages on this new thread"""
+                 on_finish: Callable[[int], None] = lambda return_code: None,
+                 main_loop: bool = False):
+        """
+        Starts an apart-core command and starts listening for zmq messages
+        :param main_loop: True => watch the socket & process from the GLib main loop, falling back to
+                          listening on this new thread when GLib is unavailable
+        """
         Thread.__init__(self, name='apart-core-runner')
         self.ipc_address = 'ipc:///tmp/apart-gtk-{}.ipc'.format(uuid.uuid4())
         self.zmq_context = zmq.Context()
@@ -51,7 +156,14 @@ class ApartCore(Thread):
         self.socket.setsockopt(zmq.RCVTIMEO, 100)
         self.socket.bind(self.ipc_address)
         self.on_finish = on_finish
-        self.listeners = listeners or []  # List[MessageListener]
+        # Dict[Tuple, Tuple[MessageListener, ...]] replaced, never mutated, on (un)register so
+        # dispatch can read it from any thread without locking
+        self.listener_index = {}
+        self.listener_lock = Lock()
+        for listener in listeners or []:
+            listener.listen_to(self)
+        self.socket_watch = None  # GLib source id, when dispatching in the main loop
+        self.process_watch = None  # GLib source id, when dispatching in the main loop
 
         if LOG_MESSAGES:
             self.register(MessageListener(lambda msg: print('apart-core ->\n {}'.format(str(msg)))))
@@ -79,42 +191,154 @@ class ApartCore(Thread):
                 print('pkexec command not found, install polkit or run as root', file=sys.stderr)
             self.zmq_context.destroy()
             sys.exit(1)
-        self.start()
+
+        if not main_loop or not self.attach_to_main_loop():
+            self.start()
 
     def run(self):
-        while self.process.returncode is None:
+        while True:
             try:
-                msg = yaml.safe_load(self.socket.recv_string())
+                msg = decode_message(self.socket.recv())
             except zmq.error.Again:
-                # no messages received within timeout
-                self.process.poll()
+                # no messages received within timeout, only stop once the core has exited so
+                # messages it sent just before exiting, ie final job messages, are dispatched
+                if self.process.poll() is not None:
+                    break
                 continue
-            default_datetime_to_utc(msg)
-            to_remove = []
-            for listener in self.listeners:
-                if listener.message_predicate(msg):
-                    if not listener.on_message(msg):
-                        to_remove.append(listener)
-            for listener in to_remove:
-                listener.stop_listening()
-            if msg['type'] == 'status' and msg['status'] == 'dying':
+            if not self.dispatch(msg):
                 break
-            self.process.poll()
-        self.zmq_context.destroy()
+        self.finish()
+
+    def attach_to_main_loop(self) -> bool:
+        """:return: False => GLib is unavailable, so messages must be received on a thread"""
+        try:
+            from gi.repository import GLib
+        except ImportError:
+            return False
+        self.socket_watch = GLib.io_add_watch(self.socket.getsockopt(zmq.FD),
+                                              GLib.PRIORITY_DEFAULT,
+                                              GLib.IO_IN,
+                                              self.on_socket_readable)
+        self.process_watch = GLib.child_watch_add(GLib.PRIORITY_DEFAULT,
+                                                  self.process.pid,
+                                                  self.on_process_exit)
+        GLib.idle_add(self.receive_pending)
+        return True
+
+    def detach_from_main_loop(self):
+        from gi.repository import GLib
+        for source_id in [self.socket_watch, self.process_watch]:
+            if source_id:
+                GLib.source_remove(source_id)
+        self.socket_watch = None
+        self.process_watch = None
+
+    def on_socket_readable(self, *args) -> bool:
+        self.receive_pending()
+        return self.socket_watch is not None
+
+    def receive_pending(self) -> bool:
+        """
+        Dispatch all queued messages, the zmq fd is edge triggered so must be drained whenever it
+        signals or after sending
+        """
+        while not self.zmq_context.closed and self.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            msg = decode_message(self.socket.recv(zmq.NOBLOCK))
+            if not self.dispatch(msg):
+                self.finish()
+        return False
+
+    def on_process_exit(self, pid: int, status: int):
+        self.process_watch = None  # child watch sources are removed after firing
+        if os.WIFEXITED(status):
+            self.process.returncode = os.WEXITSTATUS(status)
+        else:
+            self.process.returncode = -os.WTERMSIG(status)
+        self.receive_pending()
+        self.finish()
+
+    def dispatch(self, msg: Dict) -> bool:
+        """:return: False => core is dying, no more messages should be expected"""
+        if msg['type'] == 'status' and msg['status'] == 'started':
+            self.negotiate_encoding(msg)
+            self.clone_options = frozenset(msg.get('clone_options') or [])
+        index = self.listener_index
+        to_remove = []
+        for key in self.dispatch_keys(msg):
+            for listener in index.get(key, ()):
+                if listener.matches(msg) and not listener.on_message(msg):
+                    to_remove.append(listener)
+        for listener in to_remove:
+            listener.stop_listening()
+        return not (msg['type'] == 'status' and msg['status'] == 'dying')
+
+    @staticmethod
+    def dispatch_keys(msg: Dict) -> List[Tuple]:
+        """:return: listener index keys interested in this message"""
+        keys = [(msg['type'],), (None,)]
+        for key in INDEXED_KEYS:
+            if key in msg:
+                keys.append((msg['type'], key, msg[key]))
+                keys.append((None, key, msg[key]))
+        return keys
+
+    def negotiate_encoding(self, started_msg: Dict):
+        """Request the core switch to a faster encoding than yaml, if it advertises any"""
+        core_encodings = started_msg.get('encodings') or []
+        for encoding in wire_encodings():
+            if encoding in core_encodings:
+                if encoding != 'yaml':
+                    self.send('type: encoding-request\nencoding: {}'.format(encoding))
+                return
+
+    def finish(self):
+        if self.zmq_context.closed:
+            return
+        if self.socket_watch or self.process_watch:
+            self.detach_from_main_loop()
+        # the core has gone, so unsent messages must not block termination
+        self.zmq_context.destroy(linger=0)
         self.on_finish(self.process.returncode)
 
     def kill(self):
         if not self.zmq_context.closed:
             self.socket.send_string('type: kill-request')
-        self.join()
+        if self.is_alive():
+            self.join()
+        elif not self.zmq_context.closed:
+            # dispatching in the main loop, so block until the core dies like joining the runner
+            self.detach_from_main_loop()
+            self.run()
 
     def send(self, message: str):
         if not self.zmq_context.closed:
             self.socket.send_string(message)
             if LOG_MESSAGES:
                 print('apart-core <-\n----\n{}\n----'.format(message))
+            if self.socket_watch and self.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                # sending may consume the fd edge of messages already queued
+                from gi.repository import GLib
+                GLib.idle_add(self.receive_pending)
 
     def register(self, message_listener: MessageListener) -> Callable[[], None]:
-        """:return: remove function"""
-        self.listeners.append(message_listener)
-        return lambda: self.listeners.remove(message_listener)
+        """
+        Safe to call from any thread, including from within a listener during dispatch
+        :return: remove function
+        """
+        with self.listener_lock:
+            index = dict(self.listener_index)
+            for key in message_listener.index_keys():
+                index[key] = index.get(key, ()) + (message_listener,)
+            self.listener_index = index
+        return lambda: self.unregister(message_listener)
+
+    def unregister(self, message_listener: MessageListener):
+        with self.listener_lock:
+            index = dict(self.listener_index)
+            for key in message_listener.index_keys():
+                remaining = tuple(l for l in index.get(key, ()) if l is not message_listener)
+                if remaining:
+                    index[key] = remaining
+                else:
+                    index.pop(key, None)
+            self.listener_index = index
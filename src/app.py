@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
+import startup  # first, so the startup timeline includes importing
 import argparse
 import gi
 gi.require_version('Gtk', '3.0')  # require version before other importing
 import os
 import signal
-from apartcore import ApartCore, MessageListener
-from main import CloneBody
+from apartcore import ApartCore, MessageListener, main_loop_handler
 from typing import *
 from dialog import OkDialog
+import settings
+from sources import SourceIndex
 from gi.repository import GLib, Gtk, Gdk
+from version import __version__
 
-# App versions, "major.minor", major => new stuff, minor => fixes
-__version__ = '0.29'
+# main, with the job views & their dependencies, is imported once the window is shown, see import_main
+startup.mark('import')
 
 
 class LoadingBody(Gtk.Grid):
@@ -27,11 +30,15 @@ class Window(Gtk.Window):
         Gtk.Window.__init__(self, title='apart')
         self.dying = False
         self.status_listener = MessageListener(
-            on_message=lambda m: GLib.idle_add(self.on_status_msg, m),
-            message_predicate=lambda m: m['type'] == 'status')
-        self.core = ApartCore(listeners=[self.status_listener],
-                              on_finish=lambda code: GLib.idle_add(self.on_delete))
+            on_message=main_loop_handler(self.on_status_msg),
+            message_types=['status'])
+        self.core = ApartCore(listeners=[self.status_listener,
+                                         MessageListener(lambda msg: startup.mark('core connected'),
+                                                         one_time=True)],
+                              on_finish=lambda code: GLib.idle_add(self.on_delete),
+                              main_loop=True)
         self.sources = None
+        self.source_index = None  # SourceIndex of self.sources
         self.sources_interest = []  # array of callbacks on sources update
 
         self.set_default_size(height=300, width=300 * 16/9)
@@ -42,31 +49,53 @@ class Window(Gtk.Window):
         self.add(self.loading_body)
 
         self.connect('delete-event', self.on_delete)
+        self.connect('map-event', self.on_map)
 
         self.set_icon_name('apart')
 
-    def register_interest_in_sources(self, on_update_callback: Callable[[Dict], None]):
+    def on_map(self, *args) -> bool:
+        startup.mark('window mapped')
+        GLib.idle_add(self.import_main)
+        return False
+
+    @staticmethod
+    def import_main() -> bool:
+        """Import the rest of the app while apart-core starts, rather than before showing the window"""
+        import main
+        return False
+
+    def register_interest_in_sources(self,
+                                     on_update_callback: Callable[[SourceIndex], None]) -> Callable[[], None]:
         """
         Register a callback to be run every time a new sources message is received
         Note callbacks are run on the GTK main thread
         Run callback immediately if sources are available
+        :return: remove function
         """
-        if self.sources:
-            on_update_callback(self.sources)
+        if self.source_index:
+            on_update_callback(self.source_index)
         self.sources_interest.append(on_update_callback)
 
+        def remove():
+            if on_update_callback in self.sources_interest:
+                self.sources_interest.remove(on_update_callback)
+        return remove
+
     def on_status_msg(self, msg: Dict):
         if msg['status'] == 'dying':
             self.on_delete()
         elif msg['status'] == 'started':
             if msg['sources']:
+                from main import CloneBody
                 self.sources = msg['sources']
+                self.source_index = SourceIndex(self.sources)
                 self.clone_body = CloneBody(self.core,
                                             sources=msg['sources'],
                                             z_options=msg['compression_options'])
                 self.remove(self.loading_body)
                 self.add(self.clone_body)
                 self.clone_body.show_all()
+                startup.mark('sources received')
             else:
                 err_dialog = OkDialog(self,
                                       text='No partitions found',
@@ -77,10 +106,11 @@ class Window(Gtk.Window):
                 self.on_delete()
         elif self.clone_body and msg['status'] == 'running':
             self.sources = msg['sources']
+            self.source_index = SourceIndex(self.sources, previous=self.source_index)
             # TODO move to sources_interest with a reliable way of getting toplevel
             self.clone_body.update_sources(msg['sources'])
             for callback in self.sources_interest:
-                callback(self.sources)
+                callback(self.source_index)
 
     def on_delete(self, *args):
         if self.dying:
@@ -97,6 +127,7 @@ class Window(Gtk.Window):
 
 
 def main():
+    settings.preload_history()
     win = Window()
     # allow keyboard interrupt / nodemon to end program cleanly
     for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGUSR2]:
@@ -119,5 +150,9 @@ if __name__ == "__main__":
         description='Apart GTK v{} GUI for cloning & restoring partitions'.format(__version__),
         prog='apart-gtk')
     parser.add_argument('--version', '-v', action='version', version='%(prog)s v{}'.format(__version__))
-    parser.parse_args()
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print a timeline of startup to stderr: import, window mapped, core connected, '
+                             'sources received & history shown')
+    if parser.parse_args().profile_startup:
+        startup.enable()
     main()
@@ -0,0 +1,174 @@
+import re
+from gi.repository import Gtk
+import humanize
+from typing import *
+from cloneentry import active_compression, compression_combo, invalid_name_re
+from jobqueue import JobQueue, clone_request
+from partinfo import PartitionInfo, clonable, part_title
+
+
+def batch_backup_names(parts: List[Dict[str, Any]]) -> List[str]:
+    """
+    Backup names of partitions cloned together, made unique as they'll share a timestamp
+
+    >>> batch_backup_names([{'name': 'sdx1', 'label': 'data'}, {'name': 'sdx2'},
+    ...                     {'name': 'sdy1', 'label': 'data'}])
+    ['data', 'sdx2', 'data_sdy1']
+    """
+    names = []
+    for part in parts:
+        name = re.sub(invalid_name_re, '', (part.get('label') or part['name']).replace(' ', '_'))
+        if not name or name in names:
+            name = '{}_{}'.format(name, part['name']) if name else part['name']
+        names.append(name)
+    return names
+
+
+class BatchCloneEntry(Gtk.Box):
+    """Clones a selection of partitions, across disks, to image files in one go"""
+    def __init__(self, main_view: 'MainView', job_queue: JobQueue, sources: List[Dict[str, Any]],
+                 z_options: List[str]):
+        Gtk.Box.__init__(self,
+                         orientation=Gtk.Orientation.VERTICAL,
+                         expand=True,
+                         halign=Gtk.Align.CENTER)
+        self.main_view = main_view
+        self.job_queue = job_queue
+        self.checks = {}  # partition name -> Gtk.CheckButton
+        self.size_labels = {}  # partition name -> Gtk.Label
+        self.parts = {}  # partition name -> part, of those listed
+        self.layout = None  # List[Tuple[str, List[str]]] disk & partition names listed
+        self.default_disk = None  # disk name of the partition last shown, selected by default
+
+        self.title = Gtk.Label('Partitions ⟶ image files', xalign=0.5)
+        self.title.get_style_context().add_class('dim-label')
+
+        self.parts_grid = Gtk.Grid(row_spacing=3, column_spacing=6)
+        self.parts_grid.get_style_context().add_class('batch-parts')
+
+        self.z_label = Gtk.Label("Compression", xalign=1.0)
+        self.z_label.get_style_context().add_class('dim-label')
+        self.z_entry = compression_combo(z_options)
+
+        self.dir_label = Gtk.Label("Backup directory", xalign=1.0)
+        self.dir_label.get_style_context().add_class('dim-label')
+        self.dir_entry = Gtk.FileChooserButton(title='Select Backup Directory',
+                                               action=Gtk.FileChooserAction.SELECT_FOLDER)
+
+        self.cancel_btn = Gtk.Button('Cancel')
+        self.cancel_btn.connect('clicked', lambda v: self.main_view.show_progress())
+        self.start_btn = Gtk.Button('Create Images')
+        self.start_btn.connect('clicked', lambda v: self.start_clone())
+        self.buttons = Gtk.Box(halign=Gtk.Align.END)
+        self.buttons.get_style_context().add_class('new-clone-buttons')
+        self.buttons.add(self.cancel_btn)
+        self.buttons.add(self.start_btn)
+
+        self.options = Gtk.Grid(row_spacing=6)
+        self.options.get_style_context().add_class('new-clone-options')
+        self.options.attach(self.title, left=0, top=0, width=2, height=1)
+        self.options.attach(self.parts_grid, left=0, top=1, width=2, height=1)
+        self.options.attach(self.z_label, left=0, top=2, width=1, height=1)
+        self.options.attach(self.z_entry, left=1, top=2, width=1, height=1)
+        self.options.attach(self.dir_label, left=0, top=3, width=1, height=1)
+        self.options.attach(self.dir_entry, left=1, top=3, width=1, height=1)
+        self.options.attach(self.buttons, left=0, top=4, width=2, height=1)
+        self.add(self.options)
+
+        self.update_sources(sources)
+
+    def update_sources(self, sources: List[Dict[str, Any]]):
+        """
+        List clonable partitions by disk, keeping the selection of those still present & defaulting
+        new ones while not shown. Rows are only rebuilt when partitions are added or removed,
+        otherwise changed partitions are updated
+        """
+        disk_parts = [(disk['name'], [part for part in disk['parts'] if clonable(part)]) for disk in sources]
+        disk_parts = [(disk, parts) for disk, parts in disk_parts if parts]
+        layout = [(disk, [part['name'] for part in parts]) for disk, parts in disk_parts]
+        if layout != self.layout:
+            self.build_rows(disk_parts)
+            self.layout = layout
+        else:
+            for _, parts in disk_parts:
+                for part in parts:
+                    if self.parts[part['name']] != part:
+                        self.update_row(part)
+        self.update_start_sensitivity()
+
+    def build_rows(self, disk_parts: List[Tuple[str, List[Dict[str, Any]]]]):
+        checked = set(name for name, check in self.checks.items() if check.get_active())
+        listed = set(self.checks)
+        choosing = self.is_shown()
+        for child in self.parts_grid.get_children():
+            child.destroy()
+        self.checks = {}
+        self.size_labels = {}
+        self.parts = {}
+
+        top = 0
+        for disk, parts in disk_parts:
+            disk_label = Gtk.Label(disk, xalign=0)
+            disk_label.get_style_context().add_class('section-title')
+            self.parts_grid.attach(disk_label, left=0, top=top, width=2, height=1)
+            top += 1
+            for part in parts:
+                check = Gtk.CheckButton()
+                if part['name'] in listed or choosing:
+                    check.set_active(part['name'] in checked)
+                else:
+                    check.set_active(self.job_queue.disks.get(part['name']) == self.default_disk)
+                check.connect('toggled', self.update_start_sensitivity)
+                size = Gtk.Label(xalign=1)
+                size.get_style_context().add_class('dim-label')
+                self.parts_grid.attach(check, left=0, top=top, width=1, height=1)
+                self.parts_grid.attach(size, left=1, top=top, width=1, height=1)
+                self.checks[part['name']] = check
+                self.size_labels[part['name']] = size
+                self.update_row(part)
+                top += 1
+
+        self.parts_grid.show_all()
+
+    def update_row(self, part: Dict[str, Any]):
+        self.parts[part['name']] = part
+        check = self.checks[part['name']]
+        check.set_label(part_title(part))
+        if part['mounted']:
+            check.set_active(False)
+        check.set_sensitive(not part['mounted'])
+        check.set_tooltip_text('Partition is currently mounted' if part['mounted'] else None)
+        self.size_labels[part['name']].set_text(humanize.naturalsize(part['size'], binary=True))
+
+    def is_shown(self) -> bool:
+        return self.main_view.get_visible_child() is self
+
+    def use_defaults_for(self, part_info: PartitionInfo):
+        """
+        Select every unmounted clonable partition on the disk of part_info, unless shown as the user
+        may be choosing partitions across disks
+        """
+        self.default_disk = self.job_queue.disks.get(part_info.name())
+        if self.is_shown():
+            return
+        for name, check in self.checks.items():
+            check.set_active(self.job_queue.disks.get(name) == self.default_disk and not self.parts[name]['mounted'])
+
+    def selected_parts(self) -> List[Dict[str, Any]]:
+        return [self.parts[name] for name, check in self.checks.items() if check.get_active()]
+
+    def update_start_sensitivity(self, *args):
+        selected = len(self.selected_parts())
+        self.start_btn.set_sensitive(selected > 0)
+        self.start_btn.set_tooltip_text(None if selected else 'Select partitions to clone')
+
+    def start_clone(self):
+        backup_dir = self.dir_entry.get_filename()
+        parts = self.selected_parts()
+        if not backup_dir or not parts:
+            return
+
+        compression = active_compression(self.z_entry)
+        self.job_queue.submit_batch([clone_request('/dev/' + part['name'], backup_dir, name, compression)
+                                     for part, name in zip(parts, batch_backup_names(parts))])
+        self.main_view.show_progress(fade=True)
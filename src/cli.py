@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Headless apart-core frontend for scripted imaging without a display, streams job messages to stdout
+as json lines. Never imports gi, so starts fast on servers without GTK
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import sys
+import yaml
+from typing import *
+from apartcore import ApartCore, MessageListener
+from jobqueue import clone_request
+from settings import json_default
+from util import COMPRESSION_LEVELS, THREADED_COMPRESSION, preferred_compression, rm_dev
+from version import __version__
+
+EXIT_OK = 0
+EXIT_JOB_FAILED = 1
+EXIT_USAGE = 2  # as argparse
+EXIT_CORE_ERROR = 3
+EXIT_INTERRUPTED = 130
+
+JOB_TYPES = frozenset(['clone', 'restore', 'clone-failed', 'restore-failed'])
+CORE_FINISHED = 'core-finished'  # pseudo message type queued when apart-core exits
+
+
+class UsageError(Exception):
+    pass
+
+
+def print_json(msg: Dict):
+    print(json.dumps(msg, default=json_default), flush=True)
+
+
+def find_part(sources: List[Dict], name: str) -> Dict:
+    """
+    >>> find_part([{'name': 'sdx', 'parts': [{'name': 'sdx1'}]}], '/dev/sdx1')
+    {'name': 'sdx1'}
+    """
+    for disk in sources:
+        for part in disk['parts']:
+            if part['name'] == rm_dev(name):
+                return part
+    raise UsageError('partition {} not found'.format(name))
+
+
+def default_backup_name(part: Dict) -> str:
+    """
+    >>> default_backup_name({'name': 'sdx1', 'label': 'win reserved'})
+    'win_reserved'
+    """
+    return (part.get('label') or part['name']).replace(' ', '_')
+
+
+class HeadlessClient:
+    """Drives apart-core from the calling thread, receiving messages on the ApartCore runner thread"""
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.core = ApartCore(listeners=[MessageListener(self.messages.put)],
+                              on_finish=lambda code: self.messages.put({'type': CORE_FINISHED,
+                                                                        'code': code}))
+        self.started = None  # started status msg
+        self.running = {}  # id -> type of running jobs
+
+    def wait_for_start(self) -> Dict:
+        while not self.started:
+            msg = self.messages.get()
+            if msg['type'] == CORE_FINISHED:
+                raise ConnectionError('apart-core exited with code {}'.format(msg['code']))
+            if msg['type'] == 'status' and msg['status'] == 'started':
+                self.started = msg
+        return self.started
+
+    def sources(self) -> List[Dict]:
+        return self.wait_for_start()['sources']
+
+    def send(self, request: Dict):
+        self.core.send(yaml.safe_dump(request, default_flow_style=False))
+
+    def run_jobs(self, requests: List[Dict], on_message: Callable[[Dict], None]) -> int:
+        """
+        Send job requests and stream their messages until all have finished
+        :return: exit code
+        """
+        for request in requests:
+            self.send(request)
+
+        failed = False
+        finished = 0
+        while finished < len(requests):
+            msg = self.messages.get()
+            if msg['type'] == CORE_FINISHED:
+                print('apart-core exited with code {} before jobs finished'.format(msg['code']),
+                      file=sys.stderr)
+                return EXIT_CORE_ERROR
+            if msg['type'] not in JOB_TYPES:
+                continue
+            on_message(msg)
+            if msg.get('finish') or msg['type'].endswith('-failed'):
+                self.running.pop(msg['id'], None)
+                finished += 1
+                failed = failed or msg['type'].endswith('-failed')
+            else:
+                self.running[msg['id']] = msg['type']
+        return EXIT_JOB_FAILED if failed else EXIT_OK
+
+    def cancel_running(self):
+        for job_id, job_type in self.running.items():
+            self.send({'type': 'cancel-' + job_type, 'id': job_id})
+
+    def close(self):
+        self.core.kill()
+
+
+def list_sources(client: HeadlessClient, args) -> int:
+    for disk in client.sources():
+        for part in disk['parts']:
+            print_json(dict(part, disk=disk['name']))
+    return EXIT_OK
+
+
+def clone(client: HeadlessClient, args) -> int:
+    if args.name and len(args.source) > 1:
+        raise UsageError('--name only applies to a single source')
+    z_options = client.wait_for_start()['compression_options']
+    compression = args.compression or preferred_compression(z_options)
+    if compression not in z_options:
+        raise UsageError('compression {} not available, options: {}'.format(compression,
+                                                                            ', '.join(z_options)))
+    destination = os.path.abspath(args.destination)
+    if not os.path.isdir(destination):
+        raise UsageError('destination {} is not a directory'.format(destination))
+    for option, key in [('--level', 'compression_level'), ('--threads', 'compression_threads')]:
+        if getattr(args, option[2:]) is not None and key not in client.core.clone_options:
+            raise UsageError('{} is not supported by this apart-core'.format(option))
+    if args.level is not None:
+        if compression not in COMPRESSION_LEVELS:
+            raise UsageError('--level does not apply to {} compression'.format(compression))
+        min_level, max_level, _ = COMPRESSION_LEVELS[compression]
+        if not min_level <= args.level <= max_level:
+            raise UsageError('{} level must be {} to {}'.format(compression, min_level, max_level))
+    if args.threads and compression not in THREADED_COMPRESSION:
+        raise UsageError('--threads does not apply to {} compression'.format(compression))
+
+    requests = []
+    for source in args.source:
+        part = find_part(client.sources(), source)
+        if part['mounted']:
+            raise UsageError('partition {} is mounted'.format(source))
+        requests.append(clone_request('/dev/' + part['name'], destination,
+                                      name=args.name or default_backup_name(part),
+                                      compression=compression,
+                                      level=args.level,
+                                      threads=args.threads))
+    return client.run_jobs(requests, on_message=job_output(args))
+
+
+def restore(client: HeadlessClient, args) -> int:
+    if not args.yes:
+        raise UsageError('restoring overwrites all data of {}, confirm with --yes'.format(args.destination))
+    if not os.path.isfile(args.image):
+        raise UsageError('image file {} not found'.format(args.image))
+    part = find_part(client.sources(), args.destination)
+    if part['mounted']:
+        raise UsageError('partition {} is mounted'.format(args.destination))
+    request = {'type': 'restore',
+               'source': os.path.abspath(args.image),
+               'destination': '/dev/' + part['name']}
+    return client.run_jobs([request], on_message=job_output(args))
+
+
+def job_output(args) -> Callable[[Dict], None]:
+    if not args.final_only:
+        return print_json
+
+    def print_finished(msg: Dict):
+        if msg.get('finish') or msg['type'].endswith('-failed'):
+            print_json(msg)
+    return print_finished
+
+
+def parse_args(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description='Apart v{} headless partition cloning & restoring, job messages are written to '
+                    'stdout as json lines'.format(__version__),
+        epilog='exit codes: {} success, {} a job failed, {} usage error, {} apart-core error'
+               .format(EXIT_OK, EXIT_JOB_FAILED, EXIT_USAGE, EXIT_CORE_ERROR),
+        prog='apart-cli')
+    parser.add_argument('--version', '-v', action='version', version='%(prog)s v{}'.format(__version__))
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    sources_cmd = commands.add_parser('sources', help='list partitions, one json line each')
+    sources_cmd.set_defaults(run=list_sources)
+
+    clone_cmd = commands.add_parser('clone', help='clone partitions to image files')
+    clone_cmd.add_argument('source', nargs='+', help='partition, ie sdx1 or /dev/sdx1')
+    clone_cmd.add_argument('--destination', '-d', required=True, help='backup directory')
+    clone_cmd.add_argument('--name', '-n', help='backup name, default partition label or name')
+    clone_cmd.add_argument('--compression', '-z', help='compression option, default zst, gz, lz4 '
+                                                       'in order of availability')
+    clone_cmd.add_argument('--level', '-l', type=int, help='compression level, default per compressor')
+    clone_cmd.add_argument('--threads', '-t', type=int, help='compressor threads for gz & zst, '
+                                                            'default per compressor')
+    clone_cmd.set_defaults(run=clone)
+
+    restore_cmd = commands.add_parser('restore', help='restore an image file to a partition')
+    restore_cmd.add_argument('image', help='image file')
+    restore_cmd.add_argument('destination', help='partition to overwrite, ie sdx1 or /dev/sdx1')
+    restore_cmd.add_argument('--yes', '-y', action='store_true', help='confirm overwriting')
+    restore_cmd.set_defaults(run=restore)
+
+    for job_cmd in [clone_cmd, restore_cmd]:
+        job_cmd.add_argument('--final-only', action='store_true',
+                             help='only write finished & failed job messages')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    client = HeadlessClient()
+
+    def interrupt(_s, _f):
+        client.cancel_running()
+        client.close()
+        sys.exit(EXIT_INTERRUPTED)
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, interrupt)
+
+    try:
+        return args.run(client, args)
+    except UsageError as e:
+        print('apart-cli: error: {}'.format(e), file=sys.stderr)
+        return EXIT_USAGE
+    except ConnectionError as e:
+        print(str(e), file=sys.stderr)
+        return EXIT_CORE_ERROR
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
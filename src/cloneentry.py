@@ -1,20 +1,73 @@
+import os
 import re
+from datetime import timedelta
+from threading import Thread
+import humanize
+import advisor
+from advisor import Advice
 from apartcore import ApartCore
+from jobqueue import JobQueue
 from partinfo import PartitionInfo
-from gi.repository import Gtk
+from util import COMPRESSION_LEVELS, THREADED_COMPRESSION, preferred_compression
+from gi.repository import GLib, Gtk
 from typing import *
 
 invalid_name_re = re.compile(r'[^A-Za-z0-9 _-]')
+ADVISE_TIP = 'Choose the fastest compression, measured on a sample of the partition & backup directory'
+ADVISE_UNREADABLE_TIP = ADVISE_TIP + ', reading {} as root after authentication'
+THREADS_TIP = 'Compressor threads, 0 => compressor default'
+
+
+def compression_combo(z_options: List[str]) -> Gtk.ComboBox:
+    """Compression options, uncompressed first, with the preferred option active"""
+    ordered_z_options = []
+    for z_option in z_options:
+        if z_option == 'uncompressed':
+            ordered_z_options.append(z_option)
+    for z_option in z_options:
+        if z_option != 'uncompressed':
+            ordered_z_options.append(z_option)
+
+    z_store = Gtk.ListStore(str, str)
+    for z_option in ordered_z_options:
+        if z_option == 'uncompressed':
+            z_store.append([z_option, 'None'])
+        else:
+            z_store.append([z_option, z_option])
+
+    z_renderer = Gtk.CellRendererText()
+    z_entry = Gtk.ComboBox.new_with_model(z_store)
+    z_entry.pack_start(z_renderer, True)
+    z_entry.add_attribute(z_renderer, 'text', 1)
+
+    default_z_option = preferred_compression(ordered_z_options)
+    if default_z_option:
+        z_entry.set_active(ordered_z_options.index(default_z_option))
+    return z_entry
+
+
+def set_active_compression(z_entry: Gtk.ComboBox, z_option: str):
+    for index, row in enumerate(z_entry.get_model()):
+        if row[0] == z_option:
+            z_entry.set_active(index)
+
+
+def active_compression(z_entry: Gtk.ComboBox) -> Optional[str]:
+    active = z_entry.get_active_iter()
+    if active:
+        return z_entry.get_model()[active][0]
+    return None
 
 
 class CloneToImageEntry(Gtk.Box):
-    def __init__(self, main_view: 'MainView', core: ApartCore, z_options: List[str]):
+    def __init__(self, main_view: 'MainView', core: ApartCore, job_queue: JobQueue, z_options: List[str]):
         Gtk.Box.__init__(self,
                          orientation=Gtk.Orientation.VERTICAL,
                          expand=True,
                          halign=Gtk.Align.CENTER)
         self.main_view = main_view
         self.core = core
+        self.job_queue = job_queue
 
         self.title = Gtk.Label('', xalign=0.5)
         self.title.get_style_context().add_class('dim-label')
@@ -29,38 +82,36 @@ class CloneToImageEntry(Gtk.Box):
         self.dir_entry = Gtk.FileChooserButton(title='Select Backup Directory',
                                                action=Gtk.FileChooserAction.SELECT_FOLDER)
 
-        ordered_z_options = []
-        for z_option in z_options:
-            if z_option == 'uncompressed':
-                ordered_z_options.append(z_option)
-        for z_option in z_options:
-            if z_option != 'uncompressed':
-                ordered_z_options.append(z_option)
-
-        z_store = Gtk.ListStore(str, str)
-        for z_option in ordered_z_options:
-            if z_option == 'uncompressed':
-                z_store.append([z_option, 'None'])
-            else:
-                z_store.append([z_option, z_option])
-
-        z_renderer = Gtk.CellRendererText()
         self.z_label = Gtk.Label("Compression", xalign=1.0)
         self.z_label.get_style_context().add_class('dim-label')
-        self.z_entry = Gtk.ComboBox.new_with_model(z_store)
-        self.z_entry.pack_start(z_renderer, True)
-        self.z_entry.add_attribute(z_renderer, 'text', 1)
-
-        if 'zst' in ordered_z_options:
-            self.z_entry.set_active(ordered_z_options.index('zst'))
-        elif 'gz' in ordered_z_options:
-            self.z_entry.set_active(ordered_z_options.index('gz'))
-        elif 'lz4' in ordered_z_options:
-            self.z_entry.set_active(ordered_z_options.index('lz4'))
-        else:
-            self.z_entry.set_active(0)
-
+        self.z_entry = compression_combo(z_options)
         self.z_entry.connect('changed', self.update_title)
+        self.z_options = z_options
+        self.advise_btn = Gtk.Button.new_from_icon_name('system-run-symbolic', Gtk.IconSize.BUTTON)
+        self.advise_btn.set_tooltip_text(ADVISE_TIP)
+        self.advise_btn.connect('clicked', self.advise_compression)
+        self.z_box = Gtk.Box()
+        self.z_box.get_style_context().add_class('linked')
+        self.z_box.pack_start(self.z_entry, expand=True, fill=True, padding=0)
+        self.z_box.add(self.advise_btn)
+
+        self.level_label = Gtk.Label("Level", xalign=1.0)
+        self.level_label.get_style_context().add_class('dim-label')
+        self.level_entry = Gtk.SpinButton.new_with_range(1, 1, 1)
+        self.threads_label = Gtk.Label("Threads", xalign=1.0)
+        self.threads_label.get_style_context().add_class('dim-label')
+        self.threads_entry = Gtk.SpinButton.new_with_range(0, os.cpu_count() or 1, 1)
+        self.threads_entry.set_tooltip_text(THREADS_TIP)
+        self.z_settings_box = Gtk.Box(spacing=6)
+        self.z_settings_box.add(self.level_entry)
+        self.z_settings_box.add(self.threads_label)
+        self.z_settings_box.add(self.threads_entry)
+        self.z_entry.connect('changed', self.update_compression_settings)
+        self.update_compression_settings()
+        # only offer settings the core advertises, others would be ignored yet recorded in the history
+        self.level_supported = 'compression_level' in core.clone_options
+        self.threads_supported = 'compression_threads' in core.clone_options
+        self.hide_unsupported_compression_settings()
 
         self.options = Gtk.Grid(row_spacing=6)
         self.options.get_style_context().add_class('new-clone-options')
@@ -72,10 +123,15 @@ class CloneToImageEntry(Gtk.Box):
 
         self.options.attach_next_to(self.z_label, self.name_label,
                                     side=Gtk.PositionType.BOTTOM, width=1, height=1)
-        self.options.attach_next_to(self.z_entry, self.z_label,
+        self.options.attach_next_to(self.z_box, self.z_label,
                                     side=Gtk.PositionType.RIGHT, width=1, height=1)
 
-        self.options.attach_next_to(self.dir_label, self.z_label,
+        self.options.attach_next_to(self.level_label, self.z_label,
+                                    side=Gtk.PositionType.BOTTOM, width=1, height=1)
+        self.options.attach_next_to(self.z_settings_box, self.level_label,
+                                    side=Gtk.PositionType.RIGHT, width=1, height=1)
+
+        self.options.attach_next_to(self.dir_label, self.level_label,
                                     side=Gtk.PositionType.BOTTOM, width=1, height=1)
         self.options.attach_next_to(self.dir_entry, self.dir_label,
                                     side=Gtk.PositionType.RIGHT, width=1, height=1)
@@ -96,12 +152,104 @@ class CloneToImageEntry(Gtk.Box):
 
         self.last_part_info = None
 
+    def advise_compression(self, *args):
+        """Benchmark compression options on a sample of the partition, off the main thread"""
+        if not self.last_part_info:
+            return
+        self.advise_btn.set_sensitive(False)
+        self.advise_btn.set_tooltip_text('Measuring compression on a sample of ' + self.last_part_info.dev_name())
+        # the selected level & threads apply to the selected option, others are measured with defaults
+        z_settings = {key: val for key, val in [('compression_level', self.compression_level()),
+                                                 ('compression_threads', self.compression_threads())] if val}
+        Thread(target=self.run_advisor,
+               args=(self.last_part_info.dev_name(), self.last_part_info.part['size'],
+                     self.dir_entry.get_filename(), {active_compression(self.z_entry): z_settings}),
+               name='compression-advisor',
+               daemon=True).start()
+
+    def run_advisor(self, device: str, size: int, directory: Optional[str], z_settings: Dict[str, Dict[str, int]]):
+        try:
+            GLib.idle_add(self.on_advice, device,
+                          advisor.advise(device, size, self.z_options, directory, z_settings), None)
+        except OSError as e:
+            GLib.idle_add(self.on_advice, device, [], e)
+
+    def update_advise_button(self):
+        """Sampling a partition this, usually unprivileged, process can't read asks for authentication"""
+        device = self.last_part_info and self.last_part_info.dev_name()
+        self.advise_btn.set_sensitive(bool(device))
+        self.advise_btn.set_tooltip_text(ADVISE_TIP if not device or advisor.can_read(device)
+                                         else ADVISE_UNREADABLE_TIP.format(device))
+
+    def on_advice(self, device: str, advice: List[Advice], error: Optional[OSError]):
+        self.update_advise_button()
+        if not advice:
+            reason = (error.strerror or str(error)) if error else 'no compressor available'
+            self.advise_btn.set_tooltip_text('Could not measure compression: ' + reason)
+            return False
+        if self.last_part_info and self.last_part_info.dev_name() == device:
+            set_active_compression(self.z_entry, advice[0].z_option)
+        self.advise_btn.set_tooltip_text('\n'.join(
+            '{}: {:.0%} size, about {}'.format(a.z_option, a.ratio,
+                                              humanize.naturaldelta(timedelta(seconds=a.predicted_seconds)))
+            for a in advice))
+        return False
+
+    def update_compression_settings(self, *args):
+        """Level range & default of the active compression option, threads for multi-threaded compressors"""
+        z_option = active_compression(self.z_entry)
+        levels = COMPRESSION_LEVELS.get(z_option)
+        self.level_entry.set_sensitive(levels is not None)
+        if levels:
+            min_level, max_level, default_level = levels
+            self.level_entry.set_range(min_level, max_level)
+            self.level_entry.set_value(default_level)
+        self.threads_entry.set_sensitive(z_option in THREADED_COMPRESSION)
+
+    def hide_unsupported_compression_settings(self):
+        if not self.level_supported:
+            self.level_entry.set_no_show_all(True)
+            self.level_entry.hide()
+            self.threads_label.set_no_show_all(True)
+            self.threads_label.hide()
+            self.level_label.set_text('Threads')
+        if not self.threads_supported:
+            for widget in [self.threads_label, self.threads_entry]:
+                widget.set_no_show_all(True)
+                widget.hide()
+        if not self.level_supported and not self.threads_supported:
+            for widget in [self.level_label, self.z_settings_box]:
+                widget.set_no_show_all(True)
+                widget.hide()
+
+    def compression_level(self) -> Optional[int]:
+        """:return: chosen level, None => the compressor's default"""
+        if not self.level_supported:
+            return None
+        levels = COMPRESSION_LEVELS.get(active_compression(self.z_entry))
+        level = self.level_entry.get_value_as_int()
+        return level if levels and level != levels[2] else None
+
+    def compression_threads(self) -> Optional[int]:
+        if not self.threads_supported or active_compression(self.z_entry) not in THREADED_COMPRESSION:
+            return None
+        return self.threads_entry.get_value_as_int() or None
+
+    def use_compression_settings(self, z_settings: Dict[str, int]):
+        """Level & threads remembered from the history, compressor defaults otherwise"""
+        self.update_compression_settings()
+        if z_settings.get('compression_level') and self.level_entry.get_sensitive():
+            self.level_entry.set_value(z_settings['compression_level'])
+        self.threads_entry.set_value(z_settings.get('compression_threads', 0))
+
     def use_defaults_for(self, part_info: PartitionInfo):
         default_backup_name = part_info.label() or part_info.name()
         self.name_entry.set_text(default_backup_name.replace(' ', '_'))
+        self.use_compression_settings(self.main_view.progress.compression_settings_for(self.backup_name()))
 
         self.last_part_info = part_info
         self.update_title()
+        self.update_advise_button()
 
         if part_info.is_mounted():
             self.start_btn.set_sensitive(False)
@@ -111,15 +259,8 @@ class CloneToImageEntry(Gtk.Box):
             self.start_btn.set_tooltip_text(None)
 
     def update_title(self, *args: None):
-        compression = True
-        active = self.z_entry.get_active_iter()
-        if active:
-            model = self.z_entry.get_model()
-            if model[active][0] == 'uncompressed':
-                compression = False
-
         if self.last_part_info:
-            if compression:
+            if active_compression(self.z_entry) != 'uncompressed':
                 self.title.set_text(self.last_part_info.dev_name() + ' ⟶ compressed image file')
             else:
                 self.title.set_text(self.last_part_info.dev_name() + ' ⟶ uncompressed image file')
@@ -132,16 +273,8 @@ class CloneToImageEntry(Gtk.Box):
         backup_name = self.backup_name()
         source = self.last_part_info.dev_name()
 
-        compression = ""
-        active = self.z_entry.get_active_iter()
-        if active:
-            model = self.z_entry.get_model()
-            compression = "compression: {}".format(model[active][0])
-
-        self.core.send('type: clone\nsource: {}\ndestination: {}\nname: {}\n{}'.format(source,
-                                                                                       backup_dir,
-                                                                                       backup_name,
-                                                                                       compression))
+        self.job_queue.submit_clone(source, backup_dir, backup_name, active_compression(self.z_entry),
+                                    level=self.compression_level(), threads=self.compression_threads())
         self.main_view.show_progress(fade=True)
 
     def backup_name(self):
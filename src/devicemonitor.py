@@ -0,0 +1,120 @@
+import os
+from gi.repository import Gio, GLib
+from typing import *
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+SYS_BLOCK_PATH = '/sys/class/block'
+DEFAULT_DEBOUNCE_MS = 500
+
+
+class DeviceMonitor:
+    """
+    Watches for block device hotplug & mount changes from the GLib main loop, calling on_change once
+    a burst of changes has settled
+    """
+    def __init__(self, on_change: Callable[[], None], debounce_ms: int = DEFAULT_DEBOUNCE_MS):
+        self.on_change = on_change
+        self.debounce_ms = debounce_ms
+        self.debounce_source = None  # GLib source id
+        self.watch_sources = []  # GLib source ids
+        self.mountinfo = None  # file
+        self.udev_monitor = None  # pyudev.Monitor
+        self.dev_monitor = None  # Gio.FileMonitor
+        self.block_devices = set()
+
+    def start(self) -> bool:
+        """
+        :return: False => hotplug or mount changes can't be watched, so callers should also poll,
+                 whatever can be watched still calls on_change
+        """
+        watching_mounts = self.watch_mounts()
+        watching_devices = self.watch_udev() or self.watch_dev_directory()
+        return watching_mounts and watching_devices
+
+    def watch_mounts(self) -> bool:
+        try:
+            self.mountinfo = open(MOUNTINFO_PATH, 'r')
+        except OSError:
+            return False
+        self.mountinfo.read()
+        # mountinfo signals a change as an exceptional condition
+        self.watch_sources.append(GLib.io_add_watch(self.mountinfo.fileno(),
+                                                    GLib.PRIORITY_DEFAULT,
+                                                    GLib.IO_PRI | GLib.IO_ERR,
+                                                    self.on_mounts_changed))
+        return True
+
+    def watch_udev(self) -> bool:
+        if not pyudev:
+            return False
+        try:
+            self.udev_monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            self.udev_monitor.filter_by('block')
+            self.udev_monitor.start()
+        except (OSError, ValueError):
+            self.udev_monitor = None
+            return False
+        self.watch_sources.append(GLib.io_add_watch(self.udev_monitor.fileno(),
+                                                    GLib.PRIORITY_DEFAULT,
+                                                    GLib.IO_IN,
+                                                    self.on_udev_event))
+        return True
+
+    def watch_dev_directory(self) -> bool:
+        """Fallback without pyudev, watch /dev for nodes of block devices"""
+        try:
+            self.block_devices = set(os.listdir(SYS_BLOCK_PATH))
+            self.dev_monitor = Gio.File.new_for_path('/dev').monitor_directory(Gio.FileMonitorFlags.NONE,
+                                                                               None)
+        except (OSError, GLib.Error):
+            self.dev_monitor = None
+            return False
+        self.dev_monitor.connect('changed', self.on_dev_changed)
+        return True
+
+    def on_mounts_changed(self, *args) -> bool:
+        self.mountinfo.seek(0)
+        self.mountinfo.read()
+        self.changed()
+        return True
+
+    def on_udev_event(self, *args) -> bool:
+        while self.udev_monitor.poll(timeout=0):
+            pass
+        self.changed()
+        return True
+
+    def on_dev_changed(self, monitor: Gio.FileMonitor, file: Gio.File, *args):
+        name = file.get_basename()
+        if name in self.block_devices or os.path.exists(os.path.join(SYS_BLOCK_PATH, name)):
+            self.block_devices = set(os.listdir(SYS_BLOCK_PATH))
+            self.changed()
+
+    def changed(self):
+        if self.debounce_source:
+            GLib.source_remove(self.debounce_source)
+        self.debounce_source = GLib.timeout_add(self.debounce_ms, self.on_settled)
+
+    def on_settled(self) -> bool:
+        self.debounce_source = None
+        self.on_change()
+        return False
+
+    def stop(self):
+        for source in self.watch_sources + [self.debounce_source]:
+            if source:
+                GLib.source_remove(source)
+        self.watch_sources = []
+        self.debounce_source = None
+        if self.dev_monitor:
+            self.dev_monitor.cancel()
+            self.dev_monitor = None
+        if self.mountinfo:
+            self.mountinfo.close()
+            self.mountinfo = None
+        self.udev_monitor = None
@@ -1,10 +1,22 @@
-from gi.repository import Gtk
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+import heapq
+import itertools
+from gi.repository import Gio, GLib, Gtk
+from typing import *
 
 
-def rows(grid: Gtk.Grid) -> int:
+def count_rows(grid: Gtk.Grid) -> int:
     return max(map(lambda child: grid.child_get_property(child, 'top-attach'), grid.get_children()), default=-1) + 1
 
 
+def rows(grid: Gtk.Grid) -> int:
+    """:return: rows in use, scanned once then tracked as GridRowTenants attach & evict"""
+    if not hasattr(grid, 'tenant_rows'):
+        grid.tenant_rows = count_rows(grid)
+    return grid.tenant_rows
+
+
 class GridRowTenant:
     """Tool for managing one-time adding and later removing of exclusive owners of rows of a shared grid"""
     def __init__(self, grid: Gtk.Grid):
@@ -14,6 +26,7 @@ class GridRowTenant:
 
     def attach(self, widget, left=0, top=0, height=1, width=1):
         self.grid.attach(widget, left=left, top=self.base_row + top, height=height, width=width)
+        self.grid.tenant_rows = max(rows(self.grid), self.base_row + top + height)
         self.attached.append(widget)
         if hasattr(self.grid, 'on_row_change'):
             self.grid.on_row_change()
@@ -22,11 +35,245 @@ class GridRowTenant:
         return map(lambda c: self.grid.child_get_property(c, 'top-attach'), self.attached)
 
     def evict(self):
-        for row in reversed(sorted(set(self.all_row_numbers()))):
+        row_numbers = sorted(set(self.all_row_numbers()))
+        for row in reversed(row_numbers):
             self.grid.remove_row(row)
+        self.grid.tenant_rows = rows(self.grid) - len(row_numbers)
         if hasattr(self.grid, 'on_row_change'):
             self.grid.on_row_change()
 
         top = self.grid.get_child_at(top=0, left=0)
         if top and type(top) is Gtk.Separator:
             top.hide()
+
+
+class SortedListStore:
+    """Gio.ListStore kept in ascending key order, inserting & finding items by bisection"""
+    def __init__(self, item_type: type, key: Callable[[Any], Any]):
+        self.store = Gio.ListStore.new(item_type)
+        self.key = key
+        self.keys = []  # ordered keys of the store's items
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def insert(self, item) -> int:
+        """:return: index of the inserted item"""
+        key = self.key(item)
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.store.insert(index, item)
+        return index
+
+    def extend(self, items: Iterable):
+        """Add many items, with a single model change when they all belong after existing items"""
+        items = sorted(items, key=self.key)
+        keys = [self.key(item) for item in items]
+        if self.keys and keys and keys[0] < self.keys[-1]:
+            for item in items:
+                self.insert(item)
+            return
+        self.store.splice(len(self.keys), 0, items)
+        self.keys.extend(keys)
+
+    def index_of(self, item) -> int:
+        key = self.key(item)
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.store.get_item(index) is item:
+                return index
+            index += 1
+        return -1
+
+    def remove(self, item) -> bool:
+        """:return: False => item was not in the store"""
+        index = self.index_of(item)
+        if index < 0:
+            return False
+        del self.keys[index]
+        self.store.remove(index)
+        return True
+
+
+class LazyListBox(Gtk.ListBox):
+    """
+    ListBox bound to a Gio.ListModel where only rows within, or near, the visible area of the
+    scrolled window hold content widgets. Other rows are empty placeholders keeping their last
+    known height, content is created & released as they scroll in & out of view.
+    """
+    def __init__(self,
+                 model: Gio.ListModel,
+                 scroll: Gtk.ScrolledWindow,
+                 create_content: Callable[[Any], Gtk.Widget],
+                 release_content: Callable[[Any, Gtk.Widget], None] = lambda item, widget: None,
+                 estimated_row_height: int = 40,
+                 **properties):
+        Gtk.ListBox.__init__(self, selection_mode=Gtk.SelectionMode.NONE, **properties)
+        self.model = model
+        self.scroll = scroll
+        self.create_content = create_content
+        self.release_content = release_content
+        self.estimated_row_height = estimated_row_height
+        self.populated = set()  # Set[Gtk.ListBoxRow]
+        self.refresh_source = None  # GLib source id
+
+        self.bind_model(model, self.create_placeholder)
+        adjustment = scroll.get_vadjustment()
+        adjustment.connect('value-changed', self.queue_refresh)
+        adjustment.connect('changed', self.queue_refresh)
+        model.connect('items-changed', self.queue_refresh)
+
+    def create_placeholder(self, item) -> Gtk.ListBoxRow:
+        row = Gtk.ListBoxRow(activatable=False, selectable=False, visible=True)
+        row.set_size_request(-1, self.estimated_row_height)
+        return row
+
+    def queue_refresh(self, *args):
+        if not self.refresh_source:
+            self.refresh_source = GLib.idle_add(self.refresh)
+
+    def visible_range(self) -> Tuple[int, int]:
+        """:return: first & last row index within a page of the visible area"""
+        adjustment = self.scroll.get_vadjustment()
+        # offset within the scrolled content, the viewport's own coordinates already move with the scroll
+        content = self.scroll.get_child()
+        if isinstance(content, Gtk.Viewport):
+            content = content.get_child()
+        offset = self.translate_coordinates(content, 0, 0)
+        top = adjustment.get_value() - (offset[1] if offset else 0)
+        page = adjustment.get_page_size()
+        first = self.get_row_at_y(max(0, int(top - page)))
+        last = self.get_row_at_y(int(top + 2 * page))
+        return first.get_index() if first else 0, \
+            last.get_index() if last else self.model.get_n_items() - 1
+
+    def refresh(self) -> bool:
+        self.refresh_source = None
+        first, last = self.visible_range()
+        for row in list(self.populated):
+            index = row.get_index()
+            if index < 0:  # removed from the model
+                self.populated.discard(row)
+            elif index < first or index > last:
+                self.depopulate(row)
+        for index in range(first, last + 1):
+            row = self.get_row_at_index(index)
+            if row and row not in self.populated:
+                self.populated.add(row)
+                row.set_size_request(-1, -1)
+                row.add(self.create_content(self.model.get_item(index)))
+        return False
+
+    def depopulate(self, row: Gtk.ListBoxRow):
+        self.populated.discard(row)
+        content = row.get_child()
+        if content:
+            row.set_size_request(-1, row.get_allocated_height())
+            row.remove(content)
+            self.release_content(self.model.get_item(row.get_index()), content)
+            content.destroy()
+
+
+class RefreshScheduler:
+    """
+    Calls items' refresh functions at the times they are due, using a single GLib timeout for the
+    earliest. Refresh functions return when they are next due, or None.
+    """
+    def __init__(self):
+        self.queue = []  # heap of (due, sequence, item)
+        self.due = {}  # item -> due datetime, items missing or with a different due are stale
+        self.refresh_fns = {}  # item -> Callable[[], Optional[datetime]]
+        self.sequence = itertools.count()
+        self.timeout_source = None  # GLib source id
+        self.timeout_due = None  # datetime
+
+    def schedule(self, item, refresh: Callable[[], Optional[datetime]], due: datetime):
+        self.refresh_fns[item] = refresh
+        self.push(item, due)
+        self.arm()
+
+    def cancel(self, item):
+        self.due.pop(item, None)
+        self.refresh_fns.pop(item, None)
+        if len(self.queue) > 2 * len(self.due) + 16:
+            # drop stale entries so cancelled items aren't kept alive by the heap
+            self.queue = [entry for entry in self.queue if self.due.get(entry[2]) == entry[0]]
+            heapq.heapify(self.queue)
+
+    def clear(self):
+        if self.timeout_source:
+            GLib.source_remove(self.timeout_source)
+        self.timeout_source = None
+        self.timeout_due = None
+        self.queue = []
+        self.due = {}
+        self.refresh_fns = {}
+
+    def push(self, item, due: datetime):
+        self.due[item] = due
+        heapq.heappush(self.queue, (due, next(self.sequence), item))
+
+    def arm(self):
+        while self.queue and self.due.get(self.queue[0][2]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        if not self.queue or self.timeout_due and self.timeout_due <= self.queue[0][0]:
+            return
+        if self.timeout_source:
+            GLib.source_remove(self.timeout_source)
+        self.timeout_due = self.queue[0][0]
+        delay = max(0, (self.timeout_due - datetime.now(timezone.utc)).total_seconds())
+        if delay >= 1:
+            # whole second timeouts may be grouped with other wakeups
+            self.timeout_source = GLib.timeout_add_seconds(int(delay), self.on_timeout)
+        else:
+            self.timeout_source = GLib.timeout_add(int(delay * 1000), self.on_timeout)
+
+    def on_timeout(self) -> bool:
+        self.timeout_source = None
+        self.timeout_due = None
+        now = datetime.now(timezone.utc)
+        while self.queue and self.queue[0][0] <= now:
+            due, _, item = heapq.heappop(self.queue)
+            if self.due.get(item) != due:
+                continue
+            next_due = self.refresh_fns[item]()
+            if next_due:
+                self.push(item, next_due)
+            else:
+                self.cancel(item)
+        self.arm()
+        return False
+
+
+class Sparkline(Gtk.DrawingArea):
+    """Small line chart of values scaled to the tallest, drawn in the foreground color"""
+    def __init__(self, width: int = 80, height: int = 16):
+        Gtk.DrawingArea.__init__(self, valign=Gtk.Align.CENTER)
+        self.set_size_request(width, height)
+        self.values = []
+        self.get_style_context().add_class('sparkline')
+        self.connect('draw', self.on_draw)
+
+    def set_values(self, values: List[float]):
+        self.values = values
+        self.queue_draw()
+
+    def on_draw(self, widget: Gtk.Widget, cr) -> bool:
+        peak = max(self.values, default=0)
+        if len(self.values) < 2 or peak <= 0:
+            return False
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        color = self.get_style_context().get_color(self.get_state_flags())
+        cr.set_source_rgba(color.red, color.green, color.blue, color.alpha)
+        cr.set_line_width(1)
+        step = (width - 1) / (len(self.values) - 1)
+        for index, value in enumerate(self.values):
+            x = 0.5 + index * step
+            y = height - 0.5 - (height - 1) * value / peak
+            if index:
+                cr.line_to(x, y)
+            else:
+                cr.move_to(x, y)
+        cr.stroke()
+        return False
@@ -1,15 +1,16 @@
 from enum import Enum
-from gi.repository import Gtk, GLib
+from gi.repository import GLib, GObject, Gtk
 import humanize
 from apartcore import ApartCore, MessageListener
 from dialog import OkCancelDialog, OkDialog
-from gtktools import GridRowTenant
+from gtktools import Sparkline
 from partinfo import key_and_val
 import settings
+from sources import SourceIndex
+from throughput import curve_rates
 from util import *
 from typing import *
 
-FINISHED_JOB_COLUMNS = 3
 FORGET_TEXT = 'Clear'
 FORGET_TIP = 'Remove from history'
 RERUN_TIP = 'Run again'
@@ -33,33 +34,44 @@ class SourceAvailability(Enum):
     UUID_MISMATCH = 4
 
 
-class FinishedJob:
+class FinishedJob(GObject.Object):
+    """
+    History list model item of a finished job, its widgets are only built by create_row while
+    the job is visible in the list
+    """
+    reruns = True  # False => rerun is unavailable, so source updates are irrelevant
+
     def __init__(self, final_message: Dict,
                  progress_view: 'ProgressAndHistoryView',
                  core: ApartCore,
                  icon_name: str,
                  z_options: List[str],
                  forget_on_rerun: bool = True):
+        GObject.Object.__init__(self)
         self.msg = final_message
         self.finish = self.msg['finish']  # datetime
         self.core = core
         self.z_options = z_options
         self.progress_view = progress_view
-        self.tenant = None
+        self.icon_name = icon_name
         self.forget_on_rerun = forget_on_rerun
         self.extra_user_state = None  # RevealState
+        self.revealed = RevealState.default() is RevealState.REVEALED
+        self.busy_tip = None  # str, tooltip of all buttons while they're insensitive awaiting the core
+        self.row = None  # Gtk.Box, while shown
 
         self.source_available = SourceAvailability.GONE
 
-        self.duration = key_and_val(DURATION_KEY, str(round_to_second(self.msg['finish'] -
-                                                                      self.msg['start'])))
+        self.compression_available = not final_message['type'].startswith('clone') or \
+            extract_compression_option(self.msg['destination']) in z_options
 
-        self.icon = Gtk.Image.new_from_icon_name(icon_name, Gtk.IconSize.LARGE_TOOLBAR)
+    def create_row(self) -> Gtk.Widget:
+        self.icon = Gtk.Image.new_from_icon_name(self.icon_name, Gtk.IconSize.LARGE_TOOLBAR)
         title_source = Gtk.Label('', xalign=0)
         title_name = Gtk.Label('', xalign=0)
         title_destination = Gtk.Label('', xalign=0)
 
-        if final_message['type'].startswith('clone'):
+        if self.msg['type'].startswith('clone'):
             title_source.set_text(rm_dev(self.msg['source']))
             title_name.set_text(extract_name(self.msg['destination']))
             title_name.get_style_context().add_class("job-name")
@@ -74,89 +86,129 @@ class FinishedJob:
         self.title_inner_box.add(title_name)
         self.title_inner_box.add(title_destination)
         self.title_inner_box.get_style_context().add_class('finished-job-title')
-        self.title_inner_box.show_all()
-        self.title_box = Gtk.EventBox(visible=True)
+        self.title_box = Gtk.EventBox(hexpand=True)
         self.title_box.add(self.title_inner_box)
 
         self.title_box.connect('button-press-event', self.on_row_click)
 
-        self.finish_label = Gtk.Label('', halign=Gtk.Align.START, visible=True, hexpand=True)
+        self.finish_label = Gtk.Label('', halign=Gtk.Align.START)
         self.finish_label.get_style_context().add_class('finish-label')
         self.finish_label.get_style_context().add_class('dim-label')
-        self.finish_box = Gtk.EventBox(visible=True)
+        self.finish_box = Gtk.EventBox()
         self.finish_box.add(self.finish_label)
         self.finish_box.connect('button-press-event', self.on_row_click)
 
-        self.rerun_btn = Gtk.Button.new_from_icon_name('view-refresh-symbolic',
-                                                       Gtk.IconSize.SMALL_TOOLBAR)
-        self.rerun_btn.set_tooltip_text(RERUN_TIP)
-        self.rerun_btn.connect('clicked', self.rerun)
-        self.forget_btn = Gtk.Button(FORGET_TEXT)
-        self.forget_btn.set_tooltip_text(FORGET_TIP)
-        self.forget_btn.connect('clicked', self.forget)
-        self.buttons = Gtk.Box(visible=True, halign=Gtk.Align.END)
-        self.buttons.add(self.rerun_btn)
-        self.buttons.add(self.forget_btn)
+        self.buttons = Gtk.Box(halign=Gtk.Align.END)
+        for button in self.create_buttons():
+            self.buttons.add(button)
         self.buttons.get_style_context().add_class('job-buttons')
-        self.buttons.show_all()
 
-        self.extra = Gtk.Revealer(transition_duration=settings.animation_duration_ms(),
-                                  visible=True)
-        self.extra.set_reveal_child(RevealState.default() is RevealState.REVEALED)
+        self.extra = Gtk.Revealer(transition_duration=settings.animation_duration_ms())
+        self.extra.set_reveal_child(self.revealed)
+        self.stats = Gtk.VBox()
+        for stat in self.create_stats():
+            self.stats.add(stat)
+        if len(self.msg.get('throughput') or []) > 2:
+            throughput = key_and_val('Throughput', '')
+            sparkline = Sparkline(width=120)
+            sparkline.set_values(curve_rates(self.msg['throughput']))
+            throughput.add(sparkline)
+            self.stats.add(throughput)
+        self.stats.add(key_and_val(DURATION_KEY, str(round_to_second(self.msg['finish'] -
+                                                                     self.msg['start']))))
+        self.stats.get_style_context().add_class('finished-job-stats')
+        self.extra.add(self.stats)
 
-        self.compression_available = not final_message['type'].startswith('clone') or \
-            extract_compression_option(self.msg['destination']) in z_options
+        header = Gtk.Box()
+        header.add(self.title_box)
+        header.add(self.finish_box)
+        header.add(self.buttons)
+        self.row = Gtk.VBox()
+        self.row.add(header)
+        self.row.add(self.extra)
+        self.row.show_all()
         self.update()
+        return self.row
+
+    def create_stats(self) -> List[Gtk.Widget]:
+        """:return: extra details shown above the runtime when revealed"""
+        return []
+
+    def create_buttons(self) -> List[Gtk.Button]:
+        buttons = []
+        if self.reruns:
+            self.rerun_btn = Gtk.Button.new_from_icon_name('view-refresh-symbolic',
+                                                           Gtk.IconSize.SMALL_TOOLBAR)
+            self.rerun_btn.connect('clicked', self.rerun)
+            buttons.append(self.rerun_btn)
+        self.forget_btn = Gtk.Button(FORGET_TEXT)
+        self.forget_btn.connect('clicked', self.forget)
+        buttons.append(self.forget_btn)
+        return buttons
+
+    def release_row(self):
+        self.row = None
 
     def purpose(self) -> str:
         return '{} ⟶ {}'.format(rm_dev(self.msg['source']),
                                  extract_directory(self.msg['destination']))
 
-    def similar_to(self, other: 'FinishedJob') -> bool:
-        """
-        :return True => other is similar enough for both not to need to appear in the history grid
-        """
-        return type(self) == type(other) and self.purpose() == other.purpose()
-
-    def remove_from_grid(self):
-        if not self.tenant:
-            raise Exception('Not added to a grid')
-        self.tenant.evict()
-        self.tenant = None
+    def similarity_key(self) -> Tuple:
+        """:return: key equal for, and only for, jobs similar enough for both not to need to appear in the history"""
+        return type(self), self.purpose()
 
     def on_row_click(self, *args):
         self.toggle_reveal_extra()
-        self.extra_user_state = RevealState.REVEALED if self.extra.get_reveal_child() \
-            else RevealState.HIDDEN
+        self.extra_user_state = RevealState.REVEALED if self.revealed else RevealState.HIDDEN
 
     def toggle_reveal_extra(self):
-        revealed = self.extra.get_reveal_child()
-        if revealed:
-            self.extra.set_transition_type(Gtk.RevealerTransitionType.SLIDE_UP)
-        else:
-            self.extra.set_transition_type(Gtk.RevealerTransitionType.SLIDE_DOWN)
-        self.extra.set_reveal_child(not revealed)
+        self.revealed = not self.revealed
+        if self.row:
+            if self.revealed:
+                self.extra.set_transition_type(Gtk.RevealerTransitionType.SLIDE_DOWN)
+            else:
+                self.extra.set_transition_type(Gtk.RevealerTransitionType.SLIDE_UP)
+            self.extra.set_reveal_child(self.revealed)
 
     def default_extra_reveal(self):
         """Return the extra reveal state to default or as user has indicated"""
         default = self.extra_user_state or RevealState.default()
-        if default is RevealState.HIDDEN and self.extra.get_reveal_child() or \
-           default is RevealState.REVEALED and not self.extra.get_reveal_child():
+        if default is RevealState.HIDDEN and self.revealed or \
+           default is RevealState.REVEALED and not self.revealed:
             self.toggle_reveal_extra()
 
     def reveal_extra(self):
-        if not self.extra.get_reveal_child():
+        if not self.revealed:
             self.toggle_reveal_extra()
 
     def update(self):
-        finished_delta = datetime.now(timezone.utc) - self.finish
-        if finished_delta < timedelta(minutes=1):
-            finished_str = "just now"
-        else:
-            finished_str = humanize.naturaltime(finished_delta)
-
-        self.finish_label.set_text(finished_str)
-
+        if not self.row:
+            return
+        self.update_finish_label()
+        if self.busy_tip:
+            for btn in self.buttons.get_children():
+                btn.set_sensitive(False)
+                btn.set_tooltip_text(self.busy_tip)
+            return
+        self.update_buttons()
+
+    def update_finish_label(self) -> datetime:
+        """:return: when the label text will next change"""
+        now = datetime.now(timezone.utc)
+        finished_delta = now - self.finish
+        if self.row:
+            if finished_delta < timedelta(minutes=1):
+                finished_str = "just now"
+            else:
+                finished_str = humanize.naturaltime(finished_delta)
+            self.finish_label.set_text(finished_str)
+        return now + next_naturaltime_change(finished_delta)
+
+    def update_buttons(self):
+        self.forget_btn.set_sensitive(True)
+        self.forget_btn.set_tooltip_text(FORGET_TIP)
+        if not self.reruns:
+            return
         self.rerun_btn.set_sensitive(self.source_available == SourceAvailability.AVAILABLE
                                      and self.compression_available)
         tooltip = RERUN_TIP
@@ -179,35 +231,31 @@ class FinishedJob:
         backup_dir = extract_directory(self.msg['destination'])
         backup_name = extract_name(self.msg['destination'])
         z_name = extract_compression_option(self.msg['destination'])
-        self.core.send('type: clone\n'
-                       'source: {}\n'
-                       'destination: {}\n'
-                       'name: {}\n'
-                       'compression: {}'.format(self.msg['source'],
-                                                backup_dir,
-                                                backup_name,
-                                                z_name))
+        z_settings = compression_settings(self.msg)
+        self.progress_view.job_queue.submit_clone(self.msg['source'], backup_dir, backup_name, z_name,
+                                                  level=z_settings.get('compression_level'),
+                                                  threads=z_settings.get('compression_threads'))
         if self.forget_on_rerun:
             self.forget()
 
-    def add_to_grid(self, grid: Gtk.Grid):
-        raise Exception('abstract')
+    def source_name(self) -> str:
+        return rm_dev(self.msg['source'])
 
-    def on_source_update(self, sources: Dict):
-        source_part_name = rm_dev(self.msg['source'])
+    def on_source_update(self, index: SourceIndex):
+        part = index.part(self.source_name())
         source_uuid = self.msg.get('source_uuid')
-        for disk in sources:
-            for part in disk['parts']:
-                if part['name'] == source_part_name:
-                    if part['mounted']:
-                        self.source_available = SourceAvailability.MOUNTED
-                    elif source_uuid and part.get('uuid') != source_uuid:
-                        self.source_available = SourceAvailability.UUID_MISMATCH
-                    else:
-                        self.source_available = SourceAvailability.AVAILABLE
-                    return
+        if not part:
+            available = SourceAvailability.GONE
+        elif part['mounted']:
+            available = SourceAvailability.MOUNTED
+        elif source_uuid and part.get('uuid') != source_uuid:
+            available = SourceAvailability.UUID_MISMATCH
+        else:
+            available = SourceAvailability.AVAILABLE
 
-        self.source_available = SourceAvailability.GONE
+        if available != self.source_available:
+            self.source_available = available
+            self.update()
 
 
 class FailedClone(FinishedJob):
@@ -222,28 +270,9 @@ class FailedClone(FinishedJob):
                              core,
                              icon_name='dialog-error',
                              z_options=z_options)
-        self.fail_reason = key_and_val('Failed', self.msg['error'])
-        self.stats = Gtk.VBox()
-        self.stats.add(self.fail_reason)
-        self.stats.add(self.duration)
-        self.stats.get_style_context().add_class('finished-job-stats')
-        self.stats.show_all()
-        self.extra.add(self.stats)
 
-    def add_to_grid(self, grid: Gtk.Grid):
-        if self.tenant:
-            raise Exception('Already added to a grid')
-        tenant = self.tenant = GridRowTenant(grid)
-        base = 0
-        if tenant.base_row > 0:
-            tenant.attach(Gtk.Separator(visible=True, hexpand=True), width=FINISHED_JOB_COLUMNS)
-            base += 1
-        tenant.attach(self.title_box, top=base)
-        tenant.attach(self.finish_box, top=base, left=1)
-        tenant.attach(self.buttons, top=base, left=2)
-        tenant.attach(self.extra, top=base+1, width=FINISHED_JOB_COLUMNS)
-
-        grid.get_toplevel().register_interest_in_sources(on_update_callback=self.on_source_update)
+    def create_stats(self) -> List[Gtk.Widget]:
+        return [key_and_val('Failed', self.msg['error'])]
 
 
 class SuccessfulClone(FinishedJob):
@@ -259,57 +288,40 @@ class SuccessfulClone(FinishedJob):
                              forget_on_rerun=False,
                              z_options=z_options)
 
-        self.image_size = key_and_val('Image size', humanize.naturalsize(self.msg['image_size'],
-                                                                         binary=True))
-        self.filename = key_and_val('Image file', extract_filename(self.msg['destination']))
-
-        self.source_uuid = None
+    def create_stats(self) -> List[Gtk.Widget]:
+        stats = [key_and_val('Image file', extract_filename(self.msg['destination'])),
+                 key_and_val('Image size', humanize.naturalsize(self.msg['image_size'], binary=True))]
+        z_settings = compression_settings(self.msg)
+        if z_settings:
+            stats.append(key_and_val('Compression', describe_compression(
+                extract_compression_option(self.msg['destination']), z_settings)))
         if self.msg.get('source_uuid'):
-            self.source_uuid = key_and_val('Partition uuid', self.msg['source_uuid'])
+            stats.append(key_and_val('Partition uuid', self.msg['source_uuid']))
+        return stats
 
-        self.stats = Gtk.VBox()
-        for stat in [self.filename, self.image_size, self.source_uuid, self.duration]:
-            if stat:
-                self.stats.add(stat)
-
-        self.stats.get_style_context().add_class('finished-job-stats')
-        self.stats.show_all()
-        self.extra.add(self.stats)
+    def create_buttons(self) -> List[Gtk.Button]:
         self.delete_image_btn = Gtk.Button.new_from_icon_name('user-trash-full-symbolic',
                                                               Gtk.IconSize.SMALL_TOOLBAR)
-        self.delete_image_btn.set_tooltip_text(DELETE_TIP)
-        self.delete_image_btn.show_all()
         self.delete_image_btn.connect('clicked', self.delete_image)
-        self.buttons.add(self.delete_image_btn)
-        self.buttons.reorder_child(self.delete_image_btn, 0)
-
-    def add_to_grid(self, grid: Gtk.Grid):
-        if self.tenant:
-            raise Exception('Already added to a grid')
-        tenant = self.tenant = GridRowTenant(grid)
-        base = 0
-        if tenant.base_row > 0:
-            tenant.attach(Gtk.Separator(visible=True, hexpand=True), width=FINISHED_JOB_COLUMNS)
-            base += 1
-        tenant.attach(self.title_box, top=base)
-        tenant.attach(self.finish_box, top=base, left=1)
-        tenant.attach(self.buttons, top=base, left=2)
-        tenant.attach(self.extra, top=base + 1, width=FINISHED_JOB_COLUMNS)
-
-        grid.get_toplevel().register_interest_in_sources(on_update_callback=self.on_source_update)
-
-    def similar_to(self, other: FinishedJob) -> bool:
+        return [self.delete_image_btn] + FinishedJob.create_buttons(self)
+
+    def update_buttons(self):
+        FinishedJob.update_buttons(self)
+        self.delete_image_btn.set_sensitive(True)
+        self.delete_image_btn.set_tooltip_text(DELETE_TIP)
+
+    def similarity_key(self) -> Tuple:
         """
         As successful clones indicate space being taken up on the file system, it should only be
         lost from the history if another task overwrote the same file (which as it includes at
         to-minute timestamp should be rare)
         """
-        return FinishedJob.similar_to(self, other) and \
-            self.msg['destination'] == other.msg['destination']
+        return FinishedJob.similarity_key(self) + (self.msg['destination'],)
 
     def delete_image(self, arg=None):
         filename = self.msg['destination']
-        dialog = OkCancelDialog(self.delete_image_btn.get_toplevel(),
+        toplevel = self.delete_image_btn.get_toplevel()
+        dialog = OkCancelDialog(toplevel,
                                 header='Delete image file',
                                 text="Delete {}?".format(filename),
                                 message_type=Gtk.MessageType.WARNING)
@@ -318,29 +330,24 @@ class SuccessfulClone(FinishedJob):
         if user_response != Gtk.ResponseType.OK:
             return
 
-        for btn in self.buttons.get_children():
-            btn.set_sensitive(False)
-            btn.set_tooltip_text('Deleting...')
+        self.busy_tip = 'Deleting...'
+        self.update()
 
         def on_response(msg: Dict):
             if msg['type'] == 'deleted-clone':
                 self.forget()
             else:  # failed
-                err_dialog = OkDialog(self.delete_image_btn.get_toplevel(),
+                err_dialog = OkDialog(toplevel,
                                       header='Delete failed',
                                       text='Could not delete {}: {}'.format(filename, msg['error']),
                                       message_type=Gtk.MessageType.ERROR)
                 err_dialog.run()
                 err_dialog.destroy()
-                for btn in self.buttons.get_children():
-                    btn.set_sensitive(True)
-                self.forget_btn.set_tooltip_text(FORGET_TIP)
-                self.rerun_btn.set_tooltip_text(RERUN_TIP)
-                self.delete_image_btn.set_tooltip_text(DELETE_TIP)
-
-        MessageListener(message_predicate=lambda m: m['type'] in ['deleted-clone',
-                                                                  'delete-clone-failed'] and
-                                                                 m['file'] == filename,
+                self.busy_tip = None
+                self.update()
+
+        MessageListener(message_types=['deleted-clone', 'delete-clone-failed'],
+                        match={'file': filename},
                         on_message=lambda m: GLib.idle_add(on_response, m),
                         listen_to=self.core,
                         one_time=True)
@@ -349,6 +356,10 @@ class SuccessfulClone(FinishedJob):
 
 
 class FailedRestore(FinishedJob):
+    # naive rerun is unsafe for restore jobs as /dev/abc1 may refer to different partition
+    # than when last run
+    reruns = False
+
     def __init__(self, final_message:
                  Dict,
                  progress_view: 'ProgressAndHistoryView',
@@ -357,30 +368,9 @@ class FailedRestore(FinishedJob):
         FinishedJob.__init__(self, final_message, progress_view, core, icon_name='dialog-error',
                              z_options=z_options)
 
-        self.fail_reason = key_and_val('Failed', self.msg['error'])
-        self.image_source = key_and_val('Restoring from', self.msg['source'])
-        self.stats = Gtk.VBox()
-        for stat in [self.fail_reason, self.image_source, self.duration]:
-            self.stats.add(stat)
-        self.stats.get_style_context().add_class('finished-job-stats')
-        self.stats.show_all()
-        self.extra.add(self.stats)
-        # naive rerun is unsafe for restore jobs as /dev/abc1 may refer to different partition
-        # than when last run
-        self.rerun_btn.destroy()
-
-    def add_to_grid(self, grid: Gtk.Grid):
-        if self.tenant:
-            raise Exception('Already added to a grid')
-        tenant = self.tenant = GridRowTenant(grid)
-        base = 0
-        if tenant.base_row > 0:
-            tenant.attach(Gtk.Separator(visible=True, hexpand=True), width=FINISHED_JOB_COLUMNS)
-            base += 1
-        tenant.attach(self.title_box, top=base)
-        tenant.attach(self.finish_box, top=base, left=1)
-        tenant.attach(self.buttons, top=base, left=2)
-        tenant.attach(self.extra, top=base+1, width=FINISHED_JOB_COLUMNS)
+    def create_stats(self) -> List[Gtk.Widget]:
+        return [key_and_val('Failed', self.msg['error']),
+                key_and_val('Restoring from', self.msg['source'])]
 
     def purpose(self) -> str:
         """Note: used for similarity"""
@@ -388,6 +378,10 @@ class FailedRestore(FinishedJob):
 
 
 class SuccessfulRestore(FinishedJob):
+    # naive rerun is unsafe for restore jobs as /dev/abc1 may refer to different partition
+    # than when last run
+    reruns = False
+
     def __init__(self,
                  final_message: Dict,
                  progress_view: 'ProgressAndHistoryView',
@@ -400,29 +394,8 @@ class SuccessfulRestore(FinishedJob):
                              forget_on_rerun=False,
                              z_options=z_options)
 
-        self.stats = Gtk.VBox()
-        self.image_source = key_and_val('Restored from', self.msg['source'])
-        for stat in [self.image_source, self.duration]:
-            self.stats.add(stat)
-        self.stats.get_style_context().add_class('finished-job-stats')
-        self.stats.show_all()
-        self.extra.add(self.stats)
-        # naive rerun is unsafe for restore jobs as /dev/abc1 may refer to different partition
-        # than when last run
-        self.rerun_btn.destroy()
-
-    def add_to_grid(self, grid: Gtk.Grid):
-        if self.tenant:
-            raise Exception('Already added to a grid')
-        tenant = self.tenant = GridRowTenant(grid)
-        base = 0
-        if tenant.base_row > 0:
-            tenant.attach(Gtk.Separator(visible=True, hexpand=True), width=FINISHED_JOB_COLUMNS)
-            base += 1
-        tenant.attach(self.title_box, top=base)
-        tenant.attach(self.finish_box, top=base, left=1)
-        tenant.attach(self.buttons, top=base, left=2)
-        tenant.attach(self.extra, top=base + 1, width=FINISHED_JOB_COLUMNS)
+    def create_stats(self) -> List[Gtk.Widget]:
+        return [key_and_val('Restored from', self.msg['source'])]
 
     def purpose(self) -> str:
         """Note: used for similarity"""
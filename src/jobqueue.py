@@ -0,0 +1,316 @@
+import os
+import yaml
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from typing import *
+from apartcore import ApartCore, MessageListener, main_loop_handler
+import settings
+from util import COMPRESSION_SETTINGS, rm_dev
+
+SYS_DEV_BLOCK_PATH = '/sys/dev/block'
+
+
+def job_subject(msg: Dict) -> str:
+    """
+    Partition a job reads from or writes to, which identifies its first message from the core
+
+    >>> job_subject({'type': 'clone', 'source': '/dev/sdx1', 'destination': '/mnt/backups'})
+    '/dev/sdx1'
+    >>> job_subject({'type': 'restore-failed', 'source': '/mnt/a.apt.dd.gz', 'destination': '/dev/sdx1'})
+    '/dev/sdx1'
+    """
+    if msg['type'].startswith('clone'):
+        return msg['source']
+    return msg['destination']
+
+
+def clone_request(source: str, destination: str, name: str, compression: str = None,
+                  level: int = None, threads: int = None) -> Dict:
+    """:param level, threads: compression level & compressor threads, None => core default"""
+    request = {'type': 'clone', 'source': source, 'destination': destination, 'name': name}
+    if compression:
+        request['compression'] = compression
+    if level:
+        request['compression_level'] = level
+    if threads:
+        request['compression_threads'] = threads
+    return request
+
+
+def disk_of_path(path: str) -> str:
+    """
+    :return: name of the whole disk holding the filesystem of path, or 'fs:<st_dev>' for
+             filesystems not backed by a block device, ie tmpfs or network mounts
+    """
+    st_dev = os.stat(path).st_dev
+    sys_path = os.path.realpath('{}/{}:{}'.format(SYS_DEV_BLOCK_PATH, os.major(st_dev), os.minor(st_dev)))
+    if not os.path.exists(sys_path):
+        return 'fs:{}'.format(st_dev)
+    if os.path.exists(sys_path + '/partition'):
+        sys_path = os.path.dirname(sys_path)
+    return os.path.basename(sys_path)
+
+
+class QueuedJob:
+    """A clone or restore request, waiting for the devices it uses to be free"""
+    def __init__(self, request: Dict, devices: FrozenSet[str], size: int = 0,
+                 backup_devices: FrozenSet[str] = frozenset()):
+        self.request = request
+        self.devices = devices  # disk of the partition
+        self.backup_devices = backup_devices  # disk of the backup directory or image file
+        self.size = size  # bytes of the partition
+        self.id = None  # core job id, once running
+        self.start = None  # datetime, once running
+        self.complete = 0.0
+        self.finished = False  # finished or failed
+        self.cancelled = False  # removed from the queue before running
+        self.batch = None  # Batch
+
+    def subject(self) -> str:
+        return job_subject(self.request)
+
+    def description(self) -> Tuple[str, str, str]:
+        """:return: source, name & destination to display"""
+        if self.request['type'] == 'clone':
+            return rm_dev(self.request['source']), self.request['name'], self.request['destination']
+        return os.path.basename(self.request['source']), '', rm_dev(self.request['destination'])
+
+
+class Batch:
+    """
+    Jobs submitted together, ie every partition of a disk, with aggregate progress
+
+    >>> a, b = QueuedJob({}, frozenset(), size=600), QueuedJob({}, frozenset(), size=400)
+    >>> batch = Batch([a, b])
+    >>> a.start, a.complete = datetime(2017, 5, 3, 10, 0, tzinfo=timezone.utc), 0.5
+    >>> now = datetime(2017, 5, 3, 10, 0, 30, tzinfo=timezone.utc)
+    >>> batch.fraction()
+    0.3
+    >>> batch.rate(now)
+    10.0
+    >>> batch.remaining(now)
+    datetime.timedelta(seconds=70)
+    >>> a.finished, a.complete, b.cancelled = True, 1.0, True
+    >>> batch.fraction(), batch.finished()
+    (1.0, True)
+    """
+    def __init__(self, jobs: List[QueuedJob]):
+        self.jobs = jobs
+        for job in jobs:
+            job.batch = self
+
+    def active_jobs(self) -> List[QueuedJob]:
+        return [job for job in self.jobs if not job.cancelled]
+
+    def finished(self) -> bool:
+        return all(job.finished for job in self.active_jobs())
+
+    def finished_count(self) -> int:
+        return sum(1 for job in self.active_jobs() if job.finished)
+
+    def processed_bytes(self) -> float:
+        return sum(job.size * job.complete for job in self.active_jobs())
+
+    def remaining_bytes(self) -> float:
+        return sum(job.size * (1 - job.complete) for job in self.active_jobs() if not job.finished)
+
+    def fraction(self) -> float:
+        total = self.processed_bytes() + self.remaining_bytes()
+        return self.processed_bytes() / total if total else 0.0
+
+    def start(self) -> Optional[datetime]:
+        starts = [job.start for job in self.jobs if job.start]
+        return min(starts) if starts else None
+
+    def rate(self, now: datetime) -> Optional[float]:
+        """:return: bytes/second processed over all jobs since the first started"""
+        start = self.start()
+        if not start or now <= start or not self.processed_bytes():
+            return None
+        return self.processed_bytes() / (now - start).total_seconds()
+
+    def remaining(self, now: datetime) -> Optional[timedelta]:
+        rate = self.rate(now)
+        if not rate:
+            return None
+        return timedelta(seconds=round(self.remaining_bytes() / rate))
+
+
+class JobQueue:
+    """
+    Queues clone & restore requests sending them to the core only while the disk of their partition
+    is used by fewer than per_device running jobs, & the disk of their backup directory or image
+    file by fewer than per_backup_device, when limited
+
+    >>> import yaml
+    >>> class Core:
+    ...     sent = []
+    ...     clone_options = frozenset()
+    ...     def send(self, msg): self.sent.append(yaml.safe_load(msg)['source'])
+    ...     def register(self, listener): return lambda: None
+    >>> sources = [{'name': 'sda', 'parts': [{'name': 'sda1', 'size': 1}, {'name': 'sda2', 'size': 1}]},
+    ...            {'name': 'sdb', 'parts': [{'name': 'sdb1', 'size': 1}]}]
+    >>> queue = JobQueue(Core(), sources, per_device=1)
+    >>> batch = queue.submit_batch([clone_request('/dev/sda1', '/tmp', 'a'),
+    ...                             clone_request('/dev/sdb1', '/tmp', 'b'),
+    ...                             clone_request('/dev/sda2', '/tmp', 'c')])
+    >>> Core.sent, len(queue.queued)
+    (['/dev/sda1', '/dev/sdb1'], 1)
+    """
+    def __init__(self, core: ApartCore, sources: List[Dict[str, Any]], per_device: int = None,
+                 per_backup_device: int = None):
+        self.core = core
+        self.per_device = per_device or settings.jobs_per_device()
+        self.per_backup_device = per_backup_device or settings.jobs_per_backup_device()
+        self.queued = []  # List[QueuedJob] waiting, in run order
+        # self.starting: Dict[str, Deque[QueuedJob]] = {}, jobs sent to the core awaiting their
+        # first message by subject, in the order sent
+        self.starting = {}
+        self.running = {}  # id -> QueuedJob
+        self.requests = {}  # id -> request of jobs started by this queue, until taken by take_request
+        self.batches = []  # List[Batch] with unfinished jobs
+        self.disks = {}  # partition name -> disk name
+        self.sizes = {}  # partition name -> bytes
+        self.watchers = []  # callbacks on queue change
+        self.update_sources(sources)
+        self.listener = MessageListener(message_types=['clone', 'restore', 'clone-failed', 'restore-failed'],
+                                        on_message=main_loop_handler(self.on_job_message),
+                                        listen_to=core)
+
+    def update_sources(self, sources: List[Dict[str, Any]]):
+        self.disks = {}
+        self.sizes = {}
+        for disk in sources:
+            for part in disk['parts']:
+                self.disks[part['name']] = disk['name']
+                self.sizes[part['name']] = part['size']
+
+    def watch(self, on_change: Callable[[], None]) -> Callable[[], None]:
+        """:return: remove function"""
+        self.watchers.append(on_change)
+
+        def remove():
+            if on_change in self.watchers:
+                self.watchers.remove(on_change)
+        return remove
+
+    def changed(self):
+        for on_change in list(self.watchers):
+            on_change()
+
+    def devices_of(self, request: Dict) -> FrozenSet[str]:
+        partition = rm_dev(job_subject(request))
+        return frozenset([self.disks.get(partition, partition)])
+
+    def backup_devices_of(self, request: Dict) -> FrozenSet[str]:
+        if not self.per_backup_device:
+            return frozenset()
+        path = request['destination'] if request['type'] == 'clone' else request['source']
+        try:
+            return frozenset([disk_of_path(path)])
+        except OSError:
+            return frozenset()
+
+    def supported_request(self, request: Dict) -> Dict:
+        """:return: request without compression settings the core does not advertise, never recorded as used"""
+        unsupported = [key for key in COMPRESSION_SETTINGS if key in request and key not in self.core.clone_options]
+        return {key: val for key, val in request.items() if key not in unsupported} if unsupported else request
+
+    def queued_job(self, request: Dict) -> QueuedJob:
+        request = self.supported_request(request)
+        return QueuedJob(request, self.devices_of(request), size=self.sizes.get(rm_dev(job_subject(request)), 0),
+                         backup_devices=self.backup_devices_of(request))
+
+    def submit(self, request: Dict):
+        """Queue a clone or restore request message, sending it when its devices are free"""
+        self.queued.append(self.queued_job(request))
+        self.schedule()
+        self.changed()
+
+    def submit_batch(self, requests: List[Dict]) -> Batch:
+        """Queue requests together, jobs on different disks may then run in parallel"""
+        batch = Batch([self.queued_job(request) for request in requests])
+        self.batches.append(batch)
+        self.queued.extend(batch.jobs)
+        self.schedule()
+        self.changed()
+        return batch
+
+    def submit_clone(self, source: str, destination: str, name: str, compression: str = None,
+                     level: int = None, threads: int = None):
+        self.submit(clone_request(source, destination, name, compression, level, threads))
+
+    def submit_restore(self, source: str, destination: str):
+        self.submit({'type': 'restore', 'source': source, 'destination': destination})
+
+    def cancel(self, job: QueuedJob):
+        if job in self.queued:
+            self.queued.remove(job)
+            job.cancelled = True
+            self.forget_finished_batch(job)
+            self.changed()
+
+    def forget_finished_batch(self, job: QueuedJob):
+        if job.batch and job.batch in self.batches and job.batch.finished():
+            self.batches.remove(job.batch)
+
+    def move(self, job: QueuedJob, offset: int):
+        """Move a queued job earlier (negative offset) or later in the run order"""
+        if job not in self.queued:
+            return
+        index = max(0, min(len(self.queued) - 1, self.queued.index(job) + offset))
+        self.queued.remove(job)
+        self.queued.insert(index, job)
+        self.schedule()
+        self.changed()
+
+    def take_request(self, job_id: str) -> Optional[Dict]:
+        """:return: request message of a job this queue started, once only as taken when the job finishes"""
+        return self.requests.pop(job_id, None)
+
+    def busy(self) -> bool:
+        return bool(self.queued or self.starting or self.running)
+
+    def schedule(self):
+        """Start queued jobs, in order, whose devices all have capacity"""
+        active = list(chain(chain.from_iterable(self.starting.values()), self.running.values()))
+        in_use = Counter(chain.from_iterable(job.devices for job in active))
+        backup_in_use = Counter(chain.from_iterable(job.backup_devices for job in active))
+        for job in list(self.queued):
+            if any(in_use[device] >= self.per_device for device in job.devices):
+                continue
+            if self.per_backup_device and any(backup_in_use[device] >= self.per_backup_device
+                                              for device in job.backup_devices):
+                continue
+            self.queued.remove(job)
+            in_use.update(job.devices)
+            backup_in_use.update(job.backup_devices)
+            self.starting.setdefault(job.subject(), deque()).append(job)
+            self.core.send(yaml.safe_dump(job.request, default_flow_style=False))
+
+    def on_job_message(self, msg: Dict):
+        job = self.running.get(msg['id'])
+        if not job:
+            starting = self.starting.get(job_subject(msg))
+            if not starting:
+                return  # not started by this queue
+            job = starting.popleft()
+            if not starting:
+                del self.starting[job_subject(msg)]
+            job.id = msg['id']
+            job.start = msg.get('start')
+            self.running[job.id] = job
+            self.requests[job.id] = job.request
+        job.complete = msg.get('complete', job.complete)
+        if msg['type'].endswith('-failed') or msg.get('finish'):
+            del self.running[job.id]
+            job.finished = True
+            self.forget_finished_batch(job)
+            if self.queued or job.batch:
+                self.schedule()
+                self.changed()
+
+    def stop(self):
+        self.listener.stop_listening()
+        self.watchers = []
@@ -1,9 +1,12 @@
 from apartcore import ApartCore
 from typing import *
+from batchentry import BatchCloneEntry
 from cloneentry import CloneToImageEntry
-from partinfo import PartitionInfo
+from devicemonitor import DeviceMonitor
+from jobqueue import JobQueue
+from partinfo import PartitionInfo, PartitionItem, clonable
 from progress import ProgressAndHistoryView
-from gi.repository import Gtk
+from gi.repository import Gio, GObject, Gtk
 from restoreentry import RestoreFromImageEntry
 import settings
 
@@ -16,15 +19,21 @@ class CloneBody(Gtk.Box):
         Gtk.Box.__init__(self)
         self.core = core
 
+        self.job_queue = JobQueue(core, sources)
         right_panes = Gtk.VPaned(expand=True)
-        self.main_view = MainView(core, z_options)
+        self.main_view = MainView(core, self.job_queue, sources, z_options)
         self.info_view = ClonePartInfo(sources, core, self.main_view)
         right_panes.pack1(self.info_view, shrink=False)
         right_panes.pack2(self.main_view, shrink=False)
 
         self.side_bar_box = Gtk.EventBox()
-        self.side_bar_box.add(Gtk.StackSidebar(stack=self.info_view))
-        self.side_bar_box.connect('button-press-event', self.side_bar_click)
+        self.side_bar_box.add(PartitionSideBar(self.info_view))
+
+        self.device_monitor = DeviceMonitor(on_change=self.request_sources)
+        if not self.device_monitor.start():
+            # some device or mount changes can't be watched, also refresh sources on interaction
+            self.side_bar_box.connect('button-press-event', self.side_bar_click)
+        self.connect('destroy', self.on_destroy)
 
         self.paned = Gtk.Paned(expand=True)
         self.paned.pack1(self.side_bar_box, shrink=False)
@@ -33,21 +42,35 @@ class CloneBody(Gtk.Box):
         self.add(self.paned)
 
     def update_sources(self, sources: List[Dict[str, Any]]):
+        self.job_queue.update_sources(sources)
+        self.main_view.new_batch_clone.update_sources(sources)
         self.info_view.update_sources(sources)
 
-    def side_bar_click(self, *args):
+    def request_sources(self):
         self.core.send('type: status-request')
 
+    def side_bar_click(self, *args):
+        self.request_sources()
+
+    def on_destroy(self, *args):
+        self.device_monitor.stop()
+        self.job_queue.stop()
+
 
 class ClonePartInfo(Gtk.Stack):
+    """Partition pages, built when first shown, for the partitions listed in the model"""
     def __init__(self, sources: List[Dict[str, Any]], core: ApartCore, main_view: 'MainView'):
         Gtk.Stack.__init__(self)
         self.core = core
         self.sources = sources
         self.main_view = main_view
         self.updating = False
+        self.model = Gio.ListStore.new(PartitionItem)
+        self.items = {}  # name -> PartitionItem
 
         self.connect('notify::visible-child', self.on_child_change)
+        # forward to the visible page only, rather than every page listening
+        self.main_view.connect('notify::visible-child', self.on_main_view_change)
         self.get_style_context().add_class('part-info')
 
         self.update_sources(sources)
@@ -58,48 +81,116 @@ class ClonePartInfo(Gtk.Stack):
         if visible:
             self.main_view.new_clone.use_defaults_for(visible)
             self.main_view.new_restore.use_defaults_for(visible)
+            self.main_view.new_batch_clone.use_defaults_for(visible)
+            visible.on_main_view_change(self.main_view)
 
-    def update_sources(self, sources: List[Dict[str, Any]]):
-        previous_visible = self.get_visible_child_name()
+    def on_main_view_change(self, *args):
+        visible = self.get_visible_child()
+        if visible:
+            visible.on_main_view_change(self.main_view)
+
+    def show_part(self, item: PartitionItem):
+        if not item.page:
+            item.page = PartitionInfo(item.part, self.core, self.main_view)
+            self.add_named(item.page, name=item.name())
+            item.page.show_all()
+        self.set_visible_child(item.page)
+
+    def visible_item(self) -> Optional[PartitionItem]:
+        return self.items.get(self.get_visible_child_name())
+
+    def index_of(self, item: PartitionItem) -> int:
+        for idx in range(self.model.get_n_items()):
+            if self.model.get_item(idx) is item:
+                return idx
+        return -1
 
-        parts = []
+    def update_sources(self, sources: List[Dict[str, Any]]):
+        """Diff partitions by name & uuid, only building or updating widgets for those changed"""
+        parts = {}  # name -> part
         for source in sources:
             for part in source['parts']:
-                # ignore partitions <= 1 MiB & swap
-                if part['size'] > 1048576 and part.get('fstype') != "swap":
-                    parts.append(PartitionInfo(part, self.core, self.main_view))
-
-        changed_partition_info = False
-        names = list(map(lambda p: p.name(), parts))
-        for child in self.get_children():
-            if self.child_get_property(child, 'name') not in names:
-                child.destroy()
-                changed_partition_info = True
-
-        for info in parts:
-            existing = self.get_child_by_name(info.name())
-            if not existing or (existing and existing.part != info.part):
-                if existing:
-                    existing.destroy()
-                self.add_titled(info, name=info.name(), title=info.title())
-                info.show_all()
-                changed_partition_info = True
-
-        if changed_partition_info and previous_visible and self.get_child_by_name(previous_visible):
-            self.set_visible_child_name(previous_visible)
+                if clonable(part):
+                    parts[part['name']] = part
+
+        visible = self.visible_item()
+        for name in list(self.items.keys()):
+            if name not in parts:
+                item = self.items.pop(name)
+                self.model.remove(self.index_of(item))
+                if item.page:
+                    item.page.destroy()
+
+        for name, part in parts.items():
+            item = self.items.get(name)
+            if item and item.part == part:
+                continue
+            if not item:
+                item = self.items[name] = PartitionItem(part)
+                self.model.append(item)
+            elif item.part.get('uuid') == part.get('uuid'):
+                item.update_part(part)
+                if item is visible:
+                    self.on_child_change()
+            else:
+                if item.page:
+                    item.page.destroy()
+                    item.page = None
+                item.update_part(part)
+                if item is visible:
+                    self.show_part(item)
+
+        if not self.get_visible_child() and self.model.get_n_items():
+            self.show_part(self.model.get_item(0))
+
+
+class PartitionSideBar(Gtk.ScrolledWindow):
+    """Lists the partitions of a ClonePartInfo model, selecting a row shows its page"""
+    def __init__(self, info_view: ClonePartInfo):
+        Gtk.ScrolledWindow.__init__(self,
+                                    hscrollbar_policy=Gtk.PolicyType.NEVER,
+                                    shadow_type=Gtk.ShadowType.IN)
+        self.info_view = info_view
+        self.list_box = Gtk.ListBox(selection_mode=Gtk.SelectionMode.BROWSE)
+        self.list_box.get_style_context().add_class('sidebar')
+        self.list_box.bind_model(info_view.model, self.create_row)
+        self.list_box.connect('row-selected', self.on_row_selected)
+        self.add(self.list_box)
+        info_view.connect('notify::visible-child', self.on_visible_part_change)
+        self.on_visible_part_change()
+
+    @staticmethod
+    def create_row(item: PartitionItem) -> Gtk.Widget:
+        label = Gtk.Label(xalign=0, visible=True)
+        item.bind_property('title', label, 'label', GObject.BindingFlags.SYNC_CREATE)
+        return label
+
+    def on_row_selected(self, list_box: Gtk.ListBox, row: Gtk.ListBoxRow):
+        if row:
+            self.info_view.show_part(self.info_view.model.get_item(row.get_index()))
+
+    def on_visible_part_change(self, *args):
+        item = self.info_view.visible_item()
+        if item:
+            row = self.list_box.get_row_at_index(self.info_view.index_of(item))
+            if row and row is not self.list_box.get_selected_row():
+                self.list_box.select_row(row)
 
 
 class MainView(Gtk.Stack):
-    def __init__(self, core: ApartCore, z_options: List[str]):
+    def __init__(self, core: ApartCore, job_queue: JobQueue, sources: List[Dict[str, Any]],
+                 z_options: List[str]):
         Gtk.Stack.__init__(self)
         self.set_transition_type(Gtk.StackTransitionType.NONE)
         self.set_transition_duration(settings.animation_duration_ms())
-        self.new_clone = CloneToImageEntry(self, core, z_options)
+        self.new_clone = CloneToImageEntry(self, core, job_queue, z_options)
         self.add_named(self.new_clone, name='new-clone')
-        self.progress = ProgressAndHistoryView(core, z_options)
+        self.progress = ProgressAndHistoryView(core, job_queue, z_options)
         self.add_named(self.progress, name='progress')
-        self.new_restore = RestoreFromImageEntry(self, core, z_options)
+        self.new_restore = RestoreFromImageEntry(self, core, job_queue, z_options)
         self.add_named(self.new_restore, name='new-restore')
+        self.new_batch_clone = BatchCloneEntry(self, job_queue, sources, z_options)
+        self.add_named(self.new_batch_clone, name='new-batch-clone')
 
     def show(self, name, fade: bool):
         if fade:
@@ -115,3 +206,6 @@ class MainView(Gtk.Stack):
 
     def show_new_restore(self, fade: bool = False):
         self.show('new-restore', fade)
+
+    def show_new_batch_clone(self, fade: bool = False):
+        self.show('new-batch-clone', fade)
@@ -0,0 +1,174 @@
+import os
+import sys
+from threading import Lock, Thread
+from typing import *
+from gi.repository import GLib
+from util import extract_name, rm_dev
+
+# metrics are written at most this often, however often jobs progress
+DEFAULT_INTERVAL_SECONDS = 10
+
+# Tuple[name, help, type, List[Tuple[labels, value]]]
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def escape_label(val: str) -> str:
+    """
+    >>> print(escape_label('say "hi"\\n'))
+    say \\"hi\\"\\n
+    """
+    return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(families: List[MetricFamily]) -> str:
+    """
+    Prometheus text exposition format
+
+    >>> print(render([('apart_running_jobs', 'Running jobs', 'gauge', [({}, 2)]),
+    ...               ('apart_job_complete_ratio', 'Job completion', 'gauge',
+    ...                [({'id': 'a', 'source': 'sdx1'}, 0.25)])]), end='')
+    # HELP apart_running_jobs Running jobs
+    # TYPE apart_running_jobs gauge
+    apart_running_jobs 2
+    # HELP apart_job_complete_ratio Job completion
+    # TYPE apart_job_complete_ratio gauge
+    apart_job_complete_ratio{id="a",source="sdx1"} 0.25
+    """
+    lines = []
+    for name, help_text, metric_type, samples in families:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(key, escape_label(val)) for key, val in labels.items())
+            lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', repr(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def job_labels(msg: Dict) -> Dict[str, str]:
+    """
+    Labels of a running job, bounded by partitions & backup names rather than unique per job
+
+    >>> job_labels({'type': 'clone-failed', 'id': 'a', 'source': '/dev/sdx1',
+    ...             'destination': '/mnt/b/data-2017-05-03T1020.apt.ext4.zst'})
+    {'type': 'clone', 'partition': 'sdx1', 'name': 'data'}
+    """
+    job_type = msg['type'].replace('-failed', '')
+    if job_type == 'clone':
+        return {'type': job_type, 'partition': rm_dev(msg['source']), 'name': extract_name(msg['destination'])}
+    return {'type': job_type, 'partition': rm_dev(msg['destination'])}
+
+
+def job_metrics(running: List[Tuple[Dict, Optional[float]]],
+                finished: Iterable[Dict],
+                part_size: Callable[[str], Optional[int]]) -> List[MetricFamily]:
+    """
+    :param running: latest message & smoothed bytes/second of each running job
+    :param finished: final messages of finished jobs, newest first, only the newest of each job type
+                     & partition is exported
+    :param part_size: bytes of a partition by name, None if unknown
+
+    >>> from datetime import datetime, timedelta
+    >>> finish = datetime(2017, 5, 3, 10, 20)
+    >>> clone = {'type': 'clone', 'id': 'b', 'source': '/dev/sdx1', 'start': finish - timedelta(seconds=60),
+    ...          'finish': finish, 'destination': '/mnt/data-2017-05-03T1020.apt.ext4.zst', 'image_size': 50}
+    >>> failed = dict(clone, id='c', type='clone-failed', finish=finish + timedelta(days=1))
+    >>> older = dict(clone, id='a', image_size=80, finish=finish - timedelta(days=1))
+    >>> families = {name: samples for name, _, _, samples in job_metrics([], [failed, clone, older],
+    ...                                                                   lambda n: 100)}
+    >>> families['apart_last_finished_success'], families['apart_last_compression_ratio']
+    ([({'type': 'clone', 'partition': 'sdx1'}, 0.0)], [({'partition': 'sdx1'}, 2.0)])
+    """
+    rates = []
+    completion = []
+    running_labels = set()
+    for msg, byte_rate in running:
+        labels = job_labels(msg)
+        key = tuple(sorted(labels.items()))
+        if key in running_labels:
+            continue  # ie the same partition cloned twice to one name, keep a single series
+        running_labels.add(key)
+        completion.append((labels, float(msg.get('complete', 0))))
+        if byte_rate is not None:
+            rates.append((labels, float(byte_rate)))
+
+    durations = []
+    successes = []
+    timestamps = []
+    image_sizes = []
+    ratios = []
+    exported = set()  # (type, partition)
+    imaged = set()  # partitions with an exported image size
+    for msg in finished:
+        labels = job_labels(msg)
+        labels.pop('name', None)
+        succeeded = not msg['type'].endswith('-failed')
+        if succeeded and msg.get('image_size') and labels['partition'] not in imaged:
+            imaged.add(labels['partition'])
+            part_labels = {'partition': labels['partition']}
+            image_sizes.append((part_labels, float(msg['image_size'])))
+            size = part_size(labels['partition'])
+            if size:
+                ratios.append((part_labels, size / msg['image_size']))
+
+        key = (labels['type'], labels['partition'])
+        if key in exported:
+            continue
+        exported.add(key)
+        durations.append((labels, (msg['finish'] - msg['start']).total_seconds()))
+        successes.append((labels, 1.0 if succeeded else 0.0))
+        timestamps.append((labels, msg['finish'].timestamp()))
+
+    return [('apart_running_jobs', 'Clone & restore jobs running', 'gauge', [({}, float(len(running)))]),
+            ('apart_job_bytes_per_second', 'Smoothed rate of running jobs', 'gauge', rates),
+            ('apart_job_complete_ratio', 'Completion of running jobs, 0 to 1', 'gauge', completion),
+            ('apart_last_finished_duration_seconds', 'Runtime of the last finished job per partition', 'gauge',
+             durations),
+            ('apart_last_finished_success', '1 if the last finished job per partition succeeded, else 0',
+             'gauge', successes),
+            ('apart_last_finished_timestamp_seconds', 'Finish time of the last finished job per partition',
+             'gauge', timestamps),
+            ('apart_last_image_size_bytes', 'Image file size of the last successful clone per partition',
+             'gauge', image_sizes),
+            ('apart_last_compression_ratio', 'Partition size / image size of the last successful clone '
+                                             'per partition', 'gauge', ratios)]
+
+
+class MetricsExporter:
+    """
+    Writes metrics to a file, ie for the node_exporter textfile collector. Changes only schedule a
+    write, at most one per interval, the file itself is written atomically off the main thread
+    """
+    def __init__(self, path: str, collect: Callable[[], List[MetricFamily]],
+                 interval_seconds: int = DEFAULT_INTERVAL_SECONDS):
+        self.path = path
+        self.collect = collect
+        self.interval_seconds = interval_seconds
+        self.flush_source = None  # GLib source id, while a write is scheduled
+        self.write_lock = Lock()
+
+    def changed(self):
+        if not self.flush_source:
+            self.flush_source = GLib.timeout_add_seconds(self.interval_seconds, self.flush)
+
+    def flush(self) -> bool:
+        self.flush_source = None
+        text = render(self.collect())
+        Thread(target=self.write, args=(text,), name='metrics-writer', daemon=True).start()
+        return False
+
+    def write(self, text: str):
+        with self.write_lock:
+            try:
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as file:
+                    file.write(text)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print('Warn: Failed to write metrics to {}: {}'.format(self.path, e), file=sys.stderr)
+
+    def stop(self):
+        """Write the final state now"""
+        if self.flush_source:
+            GLib.source_remove(self.flush_source)
+            self.flush_source = None
+        self.write(render(self.collect()))
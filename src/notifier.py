@@ -0,0 +1,67 @@
+from gi.repository import Gio, GLib
+import sys
+
+NOTIFICATIONS_BUS_NAME = 'org.freedesktop.Notifications'
+NOTIFICATIONS_PATH = '/org/freedesktop/Notifications'
+NOTIFICATIONS_INTERFACE = 'org.freedesktop.Notifications'
+NOTIFY_TIMEOUT_MS = 5000
+
+
+class DesktopNotifier:
+    """
+    Sends desktop notifications to org.freedesktop.Notifications asynchronously, so the main loop
+    never waits on the notification daemon. Without a session bus falls back to `notify-send`
+    run in the background
+    """
+    def __init__(self, app_name: str = 'apart'):
+        self.app_name = app_name
+        self.enabled = True
+        self.bus = None  # Gio.DBusConnection
+        self.use_bus = True
+        self.connecting = True
+        self.waiting_for_bus = []  # notifications sent while connecting
+        Gio.bus_get(Gio.BusType.SESSION, None, self.on_bus)
+
+    def send(self, subject: str, body: str, icon: str):
+        if not self.enabled:
+            return
+        if self.connecting:
+            self.waiting_for_bus.append((subject, body, icon))
+        elif self.use_bus:
+            self.send_to_bus(subject, body, icon)
+        else:
+            self.notify_send(subject, body, icon)
+
+    def on_bus(self, source, result: Gio.AsyncResult):
+        self.connecting = False
+        try:
+            self.bus = Gio.bus_get_finish(result)
+        except GLib.Error:
+            self.use_bus = False
+        waiting, self.waiting_for_bus = self.waiting_for_bus, []
+        for notification in waiting:
+            self.send(*notification)
+
+    def send_to_bus(self, subject: str, body: str, icon: str):
+        args = GLib.Variant('(susssasa{sv}i)', (self.app_name, 0, icon, subject, body, [], {},
+                                                NOTIFY_TIMEOUT_MS))
+        self.bus.call(NOTIFICATIONS_BUS_NAME, NOTIFICATIONS_PATH, NOTIFICATIONS_INTERFACE, 'Notify',
+                      args, GLib.VariantType('(u)'), Gio.DBusCallFlags.NONE, -1, None,
+                      self.on_sent_to_bus, (subject, body, icon))
+
+    def on_sent_to_bus(self, bus: Gio.DBusConnection, result: Gio.AsyncResult, notification):
+        try:
+            bus.call_finish(result)
+        except GLib.Error:
+            # no notification daemon on the bus
+            self.use_bus = False
+            self.notify_send(*notification)
+
+    def notify_send(self, subject: str, body: str, icon: str):
+        try:
+            # Gio.Subprocess reaps the child from the main loop, no need to wait for it
+            Gio.Subprocess.new(['notify-send', '--icon={}'.format(icon), subject, body],
+                               Gio.SubprocessFlags.STDOUT_SILENCE | Gio.SubprocessFlags.STDERR_SILENCE)
+        except GLib.Error:
+            print('Warn: Command `notify-send` failed, disabling desktop notification', file=sys.stderr)
+            self.enabled = False
@@ -1,5 +1,5 @@
 from typing import *
-from gi.repository import Gtk
+from gi.repository import GObject, Gtk
 import humanize
 from apartcore import ApartCore
 
@@ -18,6 +18,45 @@ def key_and_val(key: str, val: str, visible=False) -> Gtk.Box:
     return box
 
 
+def clonable(part: Dict[str, Any]) -> bool:
+    """
+    Partitions worth listing to clone, ignoring partitions <= 1 MiB & swap
+    >>> clonable({'name': 'sdx1', 'size': 104857600, 'fstype': 'ext4'})
+    True
+    >>> clonable({'name': 'sdx2', 'size': 2147483648, 'fstype': 'swap'})
+    False
+    """
+    return part['size'] > 1048576 and part.get('fstype') != 'swap'
+
+
+def part_title(part: Dict[str, Any]) -> str:
+    max_length = 10
+    label = (part.get('label') or '').strip()
+    if len(label) > max_length:
+        label = label[:max_length-3].rstrip() + '...'
+    return '{} {}'.format(part['name'], label)
+
+
+class PartitionItem(GObject.Object):
+    """Sidebar model entry for a partition, its PartitionInfo page is built when first selected"""
+    title = GObject.Property(type=str)
+
+    def __init__(self, part: Dict[str, Any]):
+        GObject.Object.__init__(self)
+        self.part = part
+        self.page = None  # PartitionInfo
+        self.title = part_title(part)
+
+    def name(self) -> str:
+        return self.part['name']
+
+    def update_part(self, part: Dict[str, Any]):
+        self.part = part
+        self.title = part_title(part)
+        if self.page:
+            self.page.update_part(part)
+
+
 class PartitionInfo(Gtk.Box):
     def __init__(self, part: Dict[str, Any], core: ApartCore, main_view: 'MainView'):
         Gtk.Box.__init__(self)
@@ -26,24 +65,40 @@ class PartitionInfo(Gtk.Box):
         self.main_view = main_view
 
         self.add(key_and_val('Name', self.name()))
-        self.add(key_and_val('Type', self.part.get('fstype', 'unknown')))
-        self.add(key_and_val('Label', self.part.get('label', 'none')))
-        self.add(key_and_val('Size', humanize.naturalsize(self.part['size'], binary=True)))
+        self.fstype_info = key_and_val('Type', '')
+        self.add(self.fstype_info)
+        self.label_info = key_and_val('Label', '')
+        self.add(self.label_info)
+        self.size_info = key_and_val('Size', '')
+        self.add(self.size_info)
         self.clone_button = Gtk.Button("Clone", halign=Gtk.Align.END)
         self.restore_button = Gtk.Button("Restore", halign=Gtk.Align.END)
-        if self.is_mounted():
-            self.clone_button.set_sensitive(False)
-            self.clone_button.set_tooltip_text('Partition is currently mounted')
-            self.restore_button.set_sensitive(False)
-            self.restore_button.set_tooltip_text('Partition is currently mounted')
-        else:
-            self.clone_button.connect('clicked', lambda b: self.main_view.show_new_clone())
-            self.restore_button.connect('clicked', lambda b: self.main_view.show_new_restore())
+        self.clone_disk_button = Gtk.Button("Clone Disk", halign=Gtk.Align.END)
+        self.clone_disk_button.set_tooltip_text('Clone all partitions of the disk')
+        self.clone_button.connect('clicked', lambda b: self.main_view.show_new_clone())
+        self.restore_button.connect('clicked', lambda b: self.main_view.show_new_restore())
+        self.clone_disk_button.connect('clicked', lambda b: self.main_view.show_new_batch_clone())
         buttons = Gtk.Box(hexpand=True, halign=Gtk.Align.END)
         buttons.add(self.clone_button)
         buttons.add(self.restore_button)
+        buttons.add(self.clone_disk_button)
         self.add(buttons)
-        main_view.connect('notify::visible-child', self.on_main_view_change)
+        self.update_part(part)
+
+    def update_part(self, part: Dict[str, Any]):
+        """Update in place to show new info for the same partition"""
+        self.part = part
+        self.fstype_info.value_label.set_text(self.part.get('fstype', 'unknown'))
+        self.label_info.value_label.set_text(self.part.get('label', 'none'))
+        self.size_info.value_label.set_text(humanize.naturalsize(self.part['size'], binary=True))
+        if self.is_mounted():
+            for button in [self.clone_button, self.restore_button]:
+                button.set_sensitive(False)
+                button.set_tooltip_text('Partition is currently mounted')
+        else:
+            for button in [self.clone_button, self.restore_button]:
+                button.set_tooltip_text(None)
+            self.on_main_view_change(self.main_view)
 
     def name(self):
         return self.part['name']
@@ -55,17 +110,15 @@ class PartitionInfo(Gtk.Box):
         return self.part.get('label')
 
     def title(self):
-        max_length = 10
-        label = self.part.get('label', '').strip()
-        if len(label) > max_length:
-            label = label[:max_length-3].rstrip() + '...'
-        return '{} {}'.format(self.name(), label)
+        return part_title(self.part)
 
-    def on_main_view_change(self, main_view: Gtk.Stack, somearg):
+    def on_main_view_change(self, main_view: Gtk.Stack, *args):
+        from batchentry import BatchCloneEntry
         from cloneentry import CloneToImageEntry
         from restoreentry import RestoreFromImageEntry
 
         current_view = main_view.get_visible_child()
+        self.clone_disk_button.set_sensitive(type(current_view) is not BatchCloneEntry)
         if not self.is_mounted():
             self.clone_button.set_sensitive(type(current_view) is not CloneToImageEntry)
             self.restore_button.set_sensitive(type(current_view) is not RestoreFromImageEntry)
@@ -1,38 +1,67 @@
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from threading import Lock, Thread
 from typing import *
 from gi.repository import GLib, Gtk
 import logging
 from apartcore import ApartCore, MessageListener
+from gtktools import LazyListBox, RefreshScheduler, SortedListStore
 import historic_job
 from historic_job import FinishedJob
+from jobqueue import JobQueue, QueuedJob
 import running_job
-from running_job import RunningJob
+from running_job import RunningBatch, RunningJob
+import metrics
+from metrics import MetricFamily, MetricsExporter
+from notifier import DesktopNotifier
 import settings
-import sys
-import subprocess
+from sources import SourceIndex
+import startup
+from util import compression_settings, extract_name
 
 log = logging.getLogger('ProgressAndHistoryView')
 
+# coalesced job messages are handled at most once per frame
+FRAME_INTERVAL_MS = 1000 // 60
+
+# newest history shown first, then older jobs are loaded in chunks when idle
+HISTORY_FIRST_PAGE = 50
+HISTORY_CHUNK = 250
+
+# jobs finishing within this time of each other are notified together
+NOTIFICATION_COALESCE_MS = 1500
+
 
 class ProgressAndHistoryView(Gtk.Stack):
-    def __init__(self, core: ApartCore, z_options: List[str]):
+    def __init__(self, core: ApartCore, job_queue: JobQueue, z_options: List[str]):
         Gtk.Stack.__init__(self)
         self.core = core
+        self.job_queue = job_queue
         self.z_options = z_options
 
         self.get_style_context().add_class('progress-view')
         self.next_notification = NotificationHelper()
+        self.notifier = DesktopNotifier()
+        self.notification_source = None  # GLib source id of a pending notification
 
         self.nothing_label = Gtk.Label('Select a partition to clone', xalign=0.5, vexpand=True)
         self.nothing_label.get_style_context().add_class('dim-label')
         self.add(self.nothing_label)
 
         self.content = Gtk.VBox(valign=Gtk.Align.START)
-        self.add(self.content)
+        self.scroll = Gtk.ScrolledWindow(hscrollbar_policy=Gtk.PolicyType.NEVER)
+        self.scroll.add(self.content)
+        self.add(self.scroll)
 
         self.running_jobs_label = Gtk.Label('Running', halign=Gtk.Align.START)
         self.running_jobs_label.get_style_context().add_class('section-title')
         self.content.add(self.running_jobs_label)
 
+        self.running_batches = {}  # Batch -> RunningBatch
+        self.running_batches_box = Gtk.VBox()
+        self.running_batches_box.get_style_context().add_class('jobs')
+        self.content.add(self.running_batches_box)
+
         # self.running_jobs: Dict[str, RunningJob] = {} <- not compatible with 3.5
         self.running_jobs = {}
         self.running_jobs_grid = Gtk.Grid(orientation=Gtk.Orientation.VERTICAL,
@@ -42,72 +71,278 @@ class ProgressAndHistoryView(Gtk.Stack):
         self.running_jobs_grid.get_style_context().add_class('jobs')
         self.content.add(self.running_jobs_grid)
 
+        self.queued_jobs_label = Gtk.Label('Queued', halign=Gtk.Align.START)
+        self.queued_jobs_label.get_style_context().add_class('section-title')
+        self.content.add(self.queued_jobs_label)
+        self.queued_jobs_list = Gtk.ListBox(selection_mode=Gtk.SelectionMode.NONE)
+        self.queued_jobs_list.set_header_func(separate_rows)
+        self.queued_jobs_list.get_style_context().add_class('queued-jobs')
+        self.content.add(self.queued_jobs_list)
+        self.remove_queue_watch = job_queue.watch(self.on_queue_change)
+
         # self.finished_jobs: Dict[str, FinishedJob] = {} <- not compatible with 3.5
         self.finished_jobs = {}
+        # self.similar_jobs: Dict[Tuple, List[FinishedJob]] = {}, by FinishedJob.similarity_key
+        self.similar_jobs = {}
+        self.newest_job = None  # FinishedJob revealed on finishing
+        # self.compression_by_name: Dict[str, Tuple[datetime, Dict]] = {}, newest clone settings by backup name
+        self.compression_by_name = {}
+        self.unloaded_history = None  # deque of historic job msgs, newest first, None => unread
+        self.superseded_while_loading = set()  # similarity keys of jobs finished before loading
+        # self.jobs_by_source: Dict[str, Set[FinishedJob]] = {}, rerunnable jobs by source partition
+        self.jobs_by_source = {}
+        self.source_index = None  # SourceIndex, once received from the toplevel
+        self.remove_sources_interest = None  # Callable[[], None], once registered with the toplevel
+        self.finish_label_refresh = RefreshScheduler()
         self.finished_jobs_label = Gtk.Label('History', halign=Gtk.Align.START)
         self.finished_jobs_label.get_style_context().add_class('section-title')
         self.content.add(self.finished_jobs_label)
 
-        self.finished_jobs_grid = Gtk.Grid(orientation=Gtk.Orientation.VERTICAL,
-                                           column_spacing=6)
-        self.finished_jobs_grid.get_style_context().add_class('finished-jobs')
-        self.content.add(self.finished_jobs_grid)
+        # newest first, row widgets only exist for jobs scrolled into view
+        self.history = SortedListStore(FinishedJob, key=lambda j: -j.finish.timestamp())
+        self.finish_column = Gtk.SizeGroup(mode=Gtk.SizeGroupMode.HORIZONTAL)
+        self.buttons_column = Gtk.SizeGroup(mode=Gtk.SizeGroupMode.HORIZONTAL)
+        self.finished_jobs_list = LazyListBox(self.history.store,
+                                              scroll=self.scroll,
+                                              create_content=self.create_history_row,
+                                              release_content=lambda job, row: job.release_row())
+        self.finished_jobs_list.set_header_func(separate_rows)
+        self.finished_jobs_list.get_style_context().add_class('finished-jobs')
+        self.content.add(self.finished_jobs_list)
 
         self.show_all()
 
-        self.listener = MessageListener(message_predicate=lambda m: m['type'] in ['clone',
-                                                                                  'restore',
-                                                                                  'clone-failed',
-                                                                                  'restore-failed'],
-                                        on_message=lambda m: GLib.idle_add(self.on_job_message, m),
-                                        listen_to=core)
-
-        GLib.timeout_add(interval=1000, function=self.update_jobs)
-        self.connect('destroy', self.save_history)
-        GLib.idle_add(self.read_history)
+        self.latest_job_messages = LatestJobMessages(on_message=self.on_job_message)
+        self.listener = MessageListener(message_types=['clone',
+                                                       'restore',
+                                                       'clone-failed',
+                                                       'restore-failed'],
+                                        on_message=self.latest_job_messages.add,
+                                        listen_to=core,
+                                        weak=True)
+
+        self.running_tick = None  # GLib source id, while there are running jobs
+        self.metrics = None  # MetricsExporter, when enabled
+        if settings.metrics_path():
+            self.metrics = MetricsExporter(settings.metrics_path(), collect=self.collect_metrics)
+            self.metrics.changed()
+        self.connect('destroy', self.on_destroy)
+        Thread(target=self.read_history, name='history-reader', daemon=True).start()
 
     def read_history(self):
-        for historic_job_msg in settings.read_history():
+        """Read history off the main thread, then load it from the main loop newest first"""
+        history = settings.take_history()
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        history.sort(key=lambda msg: msg.get('finish') or oldest, reverse=True)
+        GLib.idle_add(self.on_history_read, history)
+
+    def on_history_read(self, history: List[Dict]) -> bool:
+        self.unloaded_history = deque(history)
+        more = self.load_history_chunk(HISTORY_FIRST_PAGE)
+        startup.mark('history shown')
+        if more:
+            GLib.idle_add(self.load_history_chunk)
+        return False
+
+    def history_loaded(self) -> bool:
+        return self.unloaded_history is not None and not self.unloaded_history
+
+    def load_history_chunk(self, size: int = HISTORY_CHUNK) -> bool:
+        """:return: True => more history remains to be loaded"""
+        jobs = []
+        superseded = []  # ids of jobs replaced by those finished while loading
+        for _ in range(min(size, len(self.unloaded_history))):
+            historic_job_msg = self.unloaded_history.popleft()
             try:
-                self.finished_jobs[historic_job_msg['id']] = historic_job.create(historic_job_msg,
-                                                                                 progress_view=self,
-                                                                                 core=self.core,
-                                                                                 z_options=self.z_options)
+                job = historic_job.create(historic_job_msg,
+                                          progress_view=self,
+                                          core=self.core,
+                                          z_options=self.z_options)
             except KeyError as e:
                 log.warning('Error constructing FinishedJob from historic data ' + str(e))
-
-        for job in sorted(self.finished_jobs.values(),
-                          key=lambda j: j.finish,
-                          reverse=True):
-            job.add_to_grid(self.finished_jobs_grid)
+                continue
+            if job.msg['id'] in self.finished_jobs:
+                continue
+            if job.similarity_key() in self.superseded_while_loading:
+                superseded.append(job.msg['id'])
+                continue
+            jobs.append(job)
+        settings.append_forget(*superseded)
+
+        for job in jobs:
+            self.track_finished(job)
+        self.history.extend(jobs)
         self.update_view()
+        if self.history_loaded():
+            self.superseded_while_loading.clear()
+        return not self.history_loaded()
+
+    def track_finished(self, job: FinishedJob):
+        self.finished_jobs[job.msg['id']] = job
+        self.similar_jobs.setdefault(job.similarity_key(), []).append(job)
+        self.remember_compression(job.msg)
+        self.watch_source(job)
+        self.finish_label_refresh.schedule(job, job.update_finish_label, job.update_finish_label())
+
+    def remember_compression(self, msg: Dict):
+        if not msg['type'].startswith('clone'):
+            return
+        name = extract_name(msg['destination'])
+        remembered = self.compression_by_name.get(name)
+        if not remembered or remembered[0] < msg['finish']:
+            self.compression_by_name[name] = (msg['finish'], compression_settings(msg))
+
+    def compression_settings_for(self, backup_name: str) -> Dict[str, int]:
+        """:return: compression level & threads of the newest clone with this backup name"""
+        remembered = self.compression_by_name.get(backup_name)
+        return dict(remembered[1]) if remembered else {}
+
+    def add_finished(self, job: FinishedJob):
+        self.track_finished(job)
+        self.history.insert(job)
+
+    def remove_finished(self, job: FinishedJob):
+        del self.finished_jobs[job.msg['id']]
+        similar = self.similar_jobs.get(job.similarity_key(), [])
+        if job in similar:
+            similar.remove(job)
+        if not similar:
+            self.similar_jobs.pop(job.similarity_key(), None)
+        self.history.remove(job)
+        self.unwatch_source(job)
+        self.finish_label_refresh.cancel(job)
+        job.release_row()
+
+    def create_history_row(self, job: FinishedJob) -> Gtk.Widget:
+        row = job.create_row()
+        self.finish_column.add_widget(job.finish_box)
+        self.buttons_column.add_widget(job.buttons)
+        return row
+
+    def watch_source(self, job: FinishedJob):
+        if not job.reruns:
+            return
+        self.jobs_by_source.setdefault(job.source_name(), set()).add(job)
+        if self.source_index:
+            job.on_source_update(self.source_index)
+        elif not self.remove_sources_interest:
+            self.remove_sources_interest = self.get_toplevel().register_interest_in_sources(
+                on_update_callback=self.on_source_update)
+
+    def unwatch_source(self, job: FinishedJob):
+        jobs = self.jobs_by_source.get(job.source_name())
+        if jobs:
+            jobs.discard(job)
+            if not jobs:
+                del self.jobs_by_source[job.source_name()]
+
+    def on_source_update(self, index: SourceIndex):
+        """Recompute source availability only for jobs whose source partition changed"""
+        first_update = self.source_index is None
+        self.source_index = index
+        for name, jobs in self.jobs_by_source.items():
+            if first_update or index.has_changed(name):
+                for job in jobs:
+                    job.on_source_update(index)
 
     def new_running_job(self, msg: Dict) -> RunningJob:
         job = running_job.create(msg, self.core, on_finish=self.on_job_finish)
         self.running_jobs[msg['id']] = job
         job.add_to_grid(self.running_jobs_grid)
+        if not self.running_tick:
+            self.running_tick = GLib.timeout_add(interval=1000, function=self.update_jobs)
         return job
 
     def on_job_message(self, msg: Dict):
         job = self.running_jobs.get(msg['id']) or self.new_running_job(msg)
         job.handle_message(msg)
         self.update_view()
+        if self.metrics:
+            self.metrics.changed()
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        running = [(job.last_message, job.throughput.byte_rate)
+                   for job in self.running_jobs.values() if job.last_message]
+        finished = (self.history.store.get_item(index).msg for index in range(len(self.history)))
+
+        def part_size(name: str) -> Optional[int]:
+            part = self.source_index and self.source_index.part(name)
+            return part and part['size']
+        return metrics.job_metrics(running, finished, part_size)
+
+    def on_queue_change(self):
+        for batch in list(self.running_batches):
+            if batch not in self.job_queue.batches:
+                self.running_batches.pop(batch).destroy()
+        for batch in self.job_queue.batches:
+            if batch not in self.running_batches:
+                self.running_batches[batch] = RunningBatch(batch)
+                self.running_batches_box.add(self.running_batches[batch])
+            else:
+                self.running_batches[batch].update()
+
+        for row in self.queued_jobs_list.get_children():
+            row.destroy()
+        for index, job in enumerate(self.job_queue.queued):
+            self.queued_jobs_list.add(self.create_queued_row(job,
+                                                             first=index == 0,
+                                                             last=index == len(self.job_queue.queued) - 1))
+        self.update_view()
+
+    def create_queued_row(self, job: QueuedJob, first: bool, last: bool) -> Gtk.Widget:
+        source, name, destination = job.description()
+        title = Gtk.Box(hexpand=True)
+        title.add(Gtk.Label(source, xalign=0))
+        if name:
+            title_name = Gtk.Label(name, xalign=0)
+            title_name.get_style_context().add_class('job-name')
+            title.add(title_name)
+        title.add(Gtk.Label('⟶ ' + destination, xalign=0))
+
+        earlier_btn = Gtk.Button.new_from_icon_name('go-up-symbolic', Gtk.IconSize.BUTTON)
+        earlier_btn.set_tooltip_text('Run earlier')
+        earlier_btn.set_sensitive(not first)
+        earlier_btn.connect('clicked', lambda b: self.job_queue.move(job, -1))
+        later_btn = Gtk.Button.new_from_icon_name('go-down-symbolic', Gtk.IconSize.BUTTON)
+        later_btn.set_tooltip_text('Run later')
+        later_btn.set_sensitive(not last)
+        later_btn.connect('clicked', lambda b: self.job_queue.move(job, 1))
+        cancel_btn = Gtk.Button('Cancel')
+        cancel_btn.set_tooltip_text('Remove from the queue')
+        cancel_btn.connect('clicked', lambda b: self.job_queue.cancel(job))
+        buttons = Gtk.Box()
+        buttons.get_style_context().add_class('job-buttons')
+        for button in [earlier_btn, later_btn, cancel_btn]:
+            buttons.add(button)
+
+        row = Gtk.Box()
+        row.add(title)
+        row.add(buttons)
+        row.show_all()
+        return row
 
     def update_view(self):
-        if self.running_jobs or self.finished_jobs:
-            self.set_visible_child(self.content)
+        if self.running_jobs or self.finished_jobs or self.job_queue.queued:
+            self.set_visible_child(self.scroll)
         else:
             self.set_visible_child(self.nothing_label)
+        self.queued_jobs_label.set_visible(not not self.job_queue.queued)
+        self.queued_jobs_list.set_visible(not not self.job_queue.queued)
         self.finished_jobs_label.set_visible(not not self.finished_jobs)
-        self.finished_jobs_grid.set_visible(not not self.finished_jobs)
+        self.finished_jobs_list.set_visible(not not self.finished_jobs)
         self.running_jobs_label.set_visible(not not self.running_jobs)
+        self.running_batches_box.set_visible(not not self.running_batches)
         self.running_jobs_grid.set_visible(not not self.running_jobs)
 
     def update_jobs(self) -> bool:
+        """Tick elapsed time of running jobs, finished jobs are refreshed by finish_label_refresh"""
         for job in self.running_jobs.values():
             job.update()
-        for job in self.finished_jobs.values():
-            job.update()
+        for batch in self.running_batches.values():
+            batch.update()
+        if not self.running_jobs:
+            self.running_tick = None
+            return False
         return True
 
     def on_job_finish(self, final_msg: Dict):
@@ -115,30 +350,27 @@ class ProgressAndHistoryView(Gtk.Stack):
         job = self.running_jobs[job_id]
         job.remove_from_grid()
         del self.running_jobs[job_id]
+        request = self.job_queue.take_request(job_id)
+        if request:
+            final_msg.update(compression_settings(request))
         job = historic_job.create(final_msg, progress_view=self, core=self.core, z_options=self.z_options)
         job.reveal_extra()  # show extra details of newest finished job
 
-        # remove all and re-add for ordering
-        to_remove = []
-        for existing_id, existing_job in self.finished_jobs.items():
-            existing_job.remove_from_grid()
-            if existing_job.similar_to(job):
-                to_remove.append(existing_id)
-
-        for remove_job_id in to_remove:
-            del self.finished_jobs[remove_job_id]
+        if not self.history_loaded():
+            self.superseded_while_loading.add(job.similarity_key())
+        similar_jobs = list(self.similar_jobs.get(job.similarity_key(), []))
+        for similar_job in similar_jobs:
+            self.remove_finished(similar_job)
+        self.add_finished(job)
+        settings.append_history(final_msg, forget=[similar_job.msg['id'] for similar_job in similar_jobs])
 
-        self.finished_jobs[job_id] = job
-        for finished_job in sorted(self.finished_jobs.values(),
-                                   key=lambda x: x.finish,
-                                   reverse=True):
-            finished_job.add_to_grid(self.finished_jobs_grid)
-            if finished_job != job:
-                finished_job.default_extra_reveal()
+        if self.newest_job and self.newest_job.msg['id'] in self.finished_jobs:
+            self.newest_job.default_extra_reveal()
+        self.newest_job = job
 
         self.update_view()
 
-        if self.next_notification.enabled:
+        if self.next_notification.enabled and self.notifier.enabled:
             if final_msg['type'] in ['clone', 'restore']:
                 # success
                 self.next_notification.successes += 1
@@ -147,31 +379,124 @@ class ProgressAndHistoryView(Gtk.Stack):
                 if final_msg.get('error') != 'Cancelled':
                     self.next_notification.failures += 1
 
-            if not self.running_jobs:
-                try:
-                    notification_subject = self.next_notification.subject()
-                    notification_body = self.next_notification.body()
-                    if notification_subject and notification_body:
-                        subprocess.call(['notify-send',
-                                         '--icon={}'.format(self.next_notification.icon()),
-                                         notification_subject,
-                                         notification_body])
-                        self.next_notification.reset_counts()
-                except (OSError, ValueError) as _:
-                    print('Warn: Command `notify-send` failed, disabling desktop notification',
-                          file=sys.stderr)
-                    self.next_notification.enabled = False
+            if not self.running_jobs and not self.job_queue.busy() and not self.notification_source:
+                self.notification_source = GLib.timeout_add(NOTIFICATION_COALESCE_MS, self.notify)
+
+    def notify(self) -> bool:
+        """Send a single notification for all jobs finished since the last one"""
+        self.notification_source = None
+        if self.running_jobs or self.job_queue.busy():
+            # notify once these have finished too
+            return False
+        notification_subject = self.next_notification.subject()
+        notification_body = self.next_notification.body()
+        if notification_subject and notification_body:
+            self.notifier.send(notification_subject, notification_body, self.next_notification.icon())
+            self.next_notification.reset_counts()
+        return False
 
     def forget(self, job: FinishedJob):
-        del self.finished_jobs[job.msg['id']]
-        job.remove_from_grid()
+        self.remove_finished(job)
+        settings.append_forget(job.msg['id'])
         self.update_view()
+        if self.metrics:
+            self.metrics.changed()
+
+    def on_destroy(self, *args):
+        self.listener.stop_listening()
+        self.remove_queue_watch()
+        if self.remove_sources_interest:
+            self.remove_sources_interest()
+            self.remove_sources_interest = None
+        if self.running_tick:
+            GLib.source_remove(self.running_tick)
+            self.running_tick = None
+        self.finish_label_refresh.clear()
+        if self.metrics:
+            self.metrics.stop()
+        if self.notification_source:
+            GLib.source_remove(self.notification_source)
+            self.notification_source = None
+        self.save_history()
 
     def save_history(self, arg=None):
+        """Compact the history journal, finished & forgotten jobs are already appended to it"""
+        if not self.history_loaded():
+            settings.flush_history()
+            return
         history = list(map(lambda j: j.msg, self.finished_jobs.values()))
         settings.write_history(history)
 
 
+def separate_rows(row: Gtk.ListBoxRow, before: Optional[Gtk.ListBoxRow]):
+    if before and not row.get_header():
+        row.set_header(Gtk.Separator(visible=True, hexpand=True))
+    elif not before and row.get_header():
+        row.set_header(None)
+
+
+class LatestJobMessages:
+    """
+    Coalesces job messages between flushes, keeping only the newest non-terminal message per job id.
+    Terminal messages (finish, *-failed) are never dropped, and supersede pending progress.
+    Messages may be added from any thread, flushes run in the GLib main loop.
+
+    >>> handled = []
+    >>> latest = LatestJobMessages(handled.append, schedule_flush=lambda flush: None)
+    >>> latest.add({'type': 'clone', 'id': 'a', 'complete': 0.1})
+    >>> latest.add({'type': 'clone', 'id': 'b', 'complete': 0.1})
+    >>> latest.add({'type': 'clone', 'id': 'a', 'complete': 0.2})
+    >>> latest.flush()
+    False
+    >>> [(m['id'], m['complete']) for m in handled]
+    [('a', 0.2), ('b', 0.1)]
+
+    >>> handled.clear()
+    >>> latest.add({'type': 'clone', 'id': 'a', 'complete': 0.3})
+    >>> latest.add({'type': 'clone-failed', 'id': 'a', 'error': 'Cancelled'})
+    >>> latest.add({'type': 'clone', 'id': 'b', 'complete': 1.0, 'finish': 'now'})
+    >>> latest.flush()
+    False
+    >>> [m['type'] for m in handled]
+    ['clone-failed', 'clone']
+    """
+    def __init__(self, on_message: Callable[[Dict], None],
+                 schedule_flush: Callable[[Callable[[], bool]], None] =
+                 lambda flush: GLib.timeout_add(FRAME_INTERVAL_MS, flush)):
+        self.on_message = on_message
+        self.schedule_flush = schedule_flush
+        self.lock = Lock()
+        self.progress = OrderedDict()  # job id -> newest non-terminal message
+        self.terminal = []  # List[Dict]
+        self.flush_scheduled = False
+
+    @staticmethod
+    def is_terminal(msg: Dict) -> bool:
+        return msg['type'].endswith('-failed') or bool(msg.get('finish'))
+
+    def add(self, msg: Dict):
+        with self.lock:
+            if self.is_terminal(msg):
+                self.progress.pop(msg['id'], None)
+                self.terminal.append(msg)
+            else:
+                self.progress[msg['id']] = msg
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        self.schedule_flush(self.flush)
+
+    def flush(self) -> bool:
+        with self.lock:
+            messages = list(self.progress.values()) + self.terminal
+            self.progress = OrderedDict()
+            self.terminal = []
+            self.flush_scheduled = False
+        for msg in messages:
+            self.on_message(msg)
+        return False
+
+
 class NotificationHelper:
     """
     Desktop notification helper
@@ -226,7 +551,6 @@ class NotificationHelper:
         self.successes = 0
         self.failures = 0
         self.enabled = True
-        pass
 
     def subject(self) -> str:
         if self.successes + self.failures > 0:
@@ -1,15 +1,17 @@
 from apartcore import ApartCore
 from dialog import OkCancelDialog
+from jobqueue import JobQueue
 from partinfo import PartitionInfo
 from gi.repository import Gtk
 from typing import *
 
 
 class RestoreFromImageEntry(Gtk.Box):
-    def __init__(self, main_view: 'MainView', core: ApartCore, z_options: List[str]):
+    def __init__(self, main_view: 'MainView', core: ApartCore, job_queue: JobQueue, z_options: List[str]):
         Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL, expand=True, halign=Gtk.Align.CENTER)
         self.main_view = main_view
         self.core = core
+        self.job_queue = job_queue
         self.z_options = z_options
 
         self.title = Gtk.Label('', xalign=0.5)
@@ -88,9 +90,7 @@ class RestoreFromImageEntry(Gtk.Box):
         if not image_file or not self.last_part_info:
             return
 
-        yaml_template = 'type: restore\nsource: {source}\ndestination: {destination}'
-        self.core.send(yaml_template.format(source=image_file,
-                                            destination=self.last_part_info.dev_name()))
+        self.job_queue.submit_restore(source=image_file, destination=self.last_part_info.dev_name())
         self.main_view.show_progress(fade=True)
         self.image_entry.unselect_all()
 
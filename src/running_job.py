@@ -1,8 +1,11 @@
+import time
 from gi.repository import Gtk
 import humanize
 from apartcore import ApartCore
-from gtktools import GridRowTenant
+from gtktools import GridRowTenant, Sparkline
+from jobqueue import Batch
 from partinfo import key_and_val
+from throughput import Throughput, parse_rate
 from util import *
 from typing import *
 
@@ -18,8 +21,10 @@ class RunningJob:
         self.fail_message = None  # Dict
         self.tenant = None  # GridRowTenant
         self.start = None  # datetime
+        self.monotonic_start = None  # time.monotonic() of start, as observed on the first message
         self.cancelling = False
         self.syncing = None  # Gtk.Box
+        self.throughput = Throughput()
 
         # row 1
         self.title_source = Gtk.Label('', xalign=0, visible=True)
@@ -36,6 +41,8 @@ class RunningJob:
         # row 2
         self.rate = key_and_val('Rate', '')
         self.rate.show_all()
+        self.rate_sparkline = Sparkline()
+        self.rate.add(self.rate_sparkline)
         self.elapsed = key_and_val('Elapsed', '')
         self.elapsed.show_all()
         self.estimated_completion = key_and_val('Remaining', '')
@@ -75,11 +82,13 @@ class RunningJob:
             self.progress_bar.set_fraction(msg['complete'])
             if not self.start:
                 self.start = msg['start'].replace(tzinfo=msg['start'].tzinfo or timezone.utc)
+                self.monotonic_start = time.monotonic() - self.elapsed_seconds()
                 self.update()
+            self.throughput.add(self.progress_seconds(), msg['complete'], parse_rate(msg.get('rate')))
             if msg.get('finish'):
                 self.finish()
             else:
-                self.rate.value_label.set_text(msg.get('rate') or 'Initializing')
+                self.update_rate()
                 if not self.syncing and self.last_message.get('syncing'):
                     self.syncing = Gtk.Box()
                     label = Gtk.Label("Syncing")
@@ -97,6 +106,23 @@ class RunningJob:
             self.fail_message = msg
             self.finish()
 
+    def elapsed_seconds(self) -> float:
+        return (datetime.now(timezone.utc) - self.start).total_seconds()
+
+    def progress_seconds(self) -> float:
+        """Elapsed seconds by the monotonic clock, for progress samples unaffected by clock changes"""
+        return time.monotonic() - self.monotonic_start
+
+    def update_rate(self):
+        """Show the smoothed core rate, its latest rate when it can't be parsed, & the observed progress rates"""
+        if self.throughput.byte_rate:
+            self.rate.value_label.set_text(humanize.naturalsize(self.throughput.byte_rate * 60) + '/min')
+        else:
+            self.rate.value_label.set_text(self.last_message.get('rate') or 'Initializing')
+        rates = self.throughput.recent_rates()
+        self.rate_sparkline.set_visible(len(rates) > 1)
+        self.rate_sparkline.set_values(rates)
+
     def update(self) -> bool:
         if self.fail_message or self.last_message.get('finish'):
             return False
@@ -108,14 +134,20 @@ class RunningJob:
         return True
 
     def update_remaining(self):
-        if self.last_message.get('estimated_finish'):
+        """Show the smoothed estimate, the core's estimate until there are enough samples"""
+        smoothed_remaining = self.throughput.remaining(self.progress_seconds())
+        if smoothed_remaining is not None:
+            estimated_remaining = timedelta(seconds=smoothed_remaining)
+        elif self.last_message.get('estimated_finish'):
             estimated_remaining = self.last_message['estimated_finish'] - datetime.now(timezone.utc)
-            if estimated_remaining < timedelta(seconds=5):
-                estimated_remaining_str = 'a few seconds'
-            else:
-                estimated_remaining_str = humanize.naturaldelta(estimated_remaining)
-            self.estimated_completion.value_label.set_text(estimated_remaining_str)
-            self.estimated_completion.show_all()
+        else:
+            return
+        if estimated_remaining < timedelta(seconds=5):
+            estimated_remaining_str = 'a few seconds'
+        else:
+            estimated_remaining_str = humanize.naturaldelta(estimated_remaining)
+        self.estimated_completion.value_label.set_text(estimated_remaining_str)
+        self.estimated_completion.show_all()
 
     def cancel(self, *args):
         self.cancel_btn.set_sensitive(False)
@@ -123,7 +155,11 @@ class RunningJob:
         self.cancelling = True
 
     def finish(self):
-        self.on_finish(self.fail_message or self.last_message)
+        final_message = self.fail_message or self.last_message
+        if self.throughput.sample_count > 1:
+            # summarised progress over time, kept in the history
+            final_message = dict(final_message, throughput=self.throughput.summary())
+        self.on_finish(final_message)
 
     def finished(self) -> bool:
         return bool(self.fail_message or self.last_message and self.last_message.get('finish'))
@@ -163,6 +199,43 @@ class RunningRestore(RunningJob):
             self.title_dest.set_text('⟶ ' + rm_dev(self.last_message['destination']))
 
 
+class RunningBatch(Gtk.Box):
+    """Aggregate progress, throughput & estimated remaining time of a batch of jobs"""
+    def __init__(self, batch: Batch):
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
+        self.batch = batch
+        self.title = Gtk.Label('', xalign=0)
+        self.progress_bar = Gtk.ProgressBar(hexpand=True)
+        self.rate = key_and_val('Rate', '')
+        self.estimated_completion = key_and_val('Remaining', '')
+        self.stats = Gtk.Box()
+        self.stats.add(self.rate)
+        self.stats.add(self.estimated_completion)
+        self.stats.get_style_context().add_class('job-stats')
+        self.add(self.title)
+        self.add(self.progress_bar)
+        self.add(self.stats)
+        self.get_style_context().add_class('batch')
+        self.show_all()
+        self.update()
+
+    def update(self):
+        jobs = len(self.batch.active_jobs())
+        self.title.set_text('Batch of {} partitions, {} finished'.format(jobs, self.batch.finished_count()))
+        self.progress_bar.set_fraction(self.batch.fraction())
+        now = datetime.now(timezone.utc)
+        rate = self.batch.rate(now)
+        self.rate.set_visible(bool(rate))
+        self.estimated_completion.set_visible(bool(rate))
+        if rate:
+            self.rate.value_label.set_text(humanize.naturalsize(rate * 60) + '/min')
+            remaining = self.batch.remaining(now)
+            if remaining < timedelta(seconds=5):
+                self.estimated_completion.value_label.set_text('a few seconds')
+            else:
+                self.estimated_completion.value_label.set_text(humanize.naturaldelta(remaining))
+
+
 def create(msg: Dict, core: ApartCore, on_finish: Callable[[Dict], None]) -> RunningJob:
     msg_type = msg['type']
     if msg_type.startswith('clone'):
@@ -1,7 +1,30 @@
 import os
+import json
+import logging
+from concurrent.futures import Future
+from datetime import datetime
+from queue import Empty, Queue
+from threading import Lock, Thread
 from typing import *
 import yaml
-from util import default_datetime_to_utc
+from util import default_datetime_to_utc, parse_timestamps
+
+log = logging.getLogger('settings')
+
+# Future of read_history() started by preload_history, until taken
+preloaded_history = None
+
+# encoded journal records, appended & synced by the history writer thread so the main loop never
+# waits on fsync, see append_history_records
+journal_queue = Queue()
+journal_writer = None  # Thread, started by the first append
+journal_writer_lock = Lock()
+# held by the writer thread across each append & by compaction from reading to replacing the journal,
+# so records appended meanwhile land in the compacted journal
+journal_lock = Lock()
+
+# compact the history journal on reading when it holds this many more records than live jobs
+COMPACT_SLACK_RECORDS = 100
 
 
 def default_config_directory() -> str:
@@ -16,21 +39,172 @@ def config_directory() -> str:
 
 
 def history_path() -> str:
+    """Legacy full history, only read to migrate to the journal"""
     return config_directory() + '/history.yaml'
 
 
-def read_history() -> List[Dict]:
+def history_journal_path() -> str:
+    """Append-only history, one json record per line of a finished or forgotten job"""
+    return config_directory() + '/history.jsonl'
+
+
+def json_default(val):
+    if isinstance(val, datetime):
+        return val.isoformat()
+    raise TypeError('Cannot serialize ' + type(val).__name__)
+
+
+def encode_record(record: Dict) -> str:
+    return json.dumps(record, default=json_default, separators=(',', ':')) + '\n'
+
+
+def read_legacy_history() -> List[Dict]:
     if not os.path.exists(history_path()):
         return []
     with open(history_path(), 'r') as file:
-        return default_datetime_to_utc(yaml.safe_load(file.read()))
+        return default_datetime_to_utc(yaml.load(file.read(), Loader=getattr(yaml, 'CSafeLoader',
+                                                                              yaml.SafeLoader)) or [])
+
+
+def read_history() -> List[Dict]:
+    """Replay the history journal, migrating from history.yaml when there is no journal yet"""
+    with journal_lock:
+        if not os.path.exists(history_journal_path()):
+            history = read_legacy_history()
+            if history:
+                replace_journal(history)
+            return history
+
+        jobs = {}  # id -> job msg, ordered by insertion
+        records = 0
+        unreadable = False
+        with open(history_journal_path(), 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line, object_hook=parse_timestamps)
+                except ValueError:
+                    # a crash while appending may leave a partial last line
+                    log.warning('Ignoring unreadable history record: ' + line.strip())
+                    unreadable = True
+                    continue
+                records += 1
+                if 'forget' in record:
+                    jobs.pop(record['forget'], None)
+                elif 'job' in record:
+                    jobs[record['job']['id']] = record['job']
+
+        history = list(jobs.values())
+        if unreadable or records > len(history) + COMPACT_SLACK_RECORDS:
+            replace_journal(history)
+        return history
+
+
+def preload_history():
+    """Start reading the history on a thread, so it is parsed while apart-core starts"""
+    global preloaded_history
+    if preloaded_history:
+        return
+    preloaded_history = Future()
+
+    def read(future: Future):
+        try:
+            future.set_result(read_history())
+        except Exception as e:
+            future.set_exception(e)
+    Thread(target=read, args=(preloaded_history,), name='history-preload', daemon=True).start()
+
+
+def take_history() -> List[Dict]:
+    """:return: the preloaded history, waiting for it if still being read, otherwise read now"""
+    global preloaded_history
+    preload, preloaded_history = preloaded_history, None
+    if preload:
+        return preload.result()
+    return read_history()
+
+
+def append_history_records(records: List[Dict]):
+    """Queue records to be appended to the journal with a single write & fsync, off this thread"""
+    global journal_writer
+    if not records:
+        return
+    with journal_writer_lock:
+        if not journal_writer:
+            journal_writer = Thread(target=write_journal, name='history-writer', daemon=True)
+            journal_writer.start()
+    journal_queue.put(''.join(map(encode_record, records)))
+
+
+def write_journal():
+    """History writer thread, appending whatever has been queued since the last fsync"""
+    while True:
+        chunks = [journal_queue.get()]
+        while True:
+            try:
+                chunks.append(journal_queue.get_nowait())
+            except Empty:
+                break
+        try:
+            with journal_lock:
+                os.makedirs(config_directory(), exist_ok=True)
+                with open(history_journal_path(), 'a') as file:
+                    file.write(''.join(chunks))
+                    file.flush()
+                    os.fsync(file.fileno())
+        except OSError as e:
+            log.warning('Failed to append to the history journal: ' + str(e))
+        finally:
+            for _ in chunks:
+                journal_queue.task_done()
+
+
+def flush_history():
+    """Wait until queued journal records are written"""
+    journal_queue.join()
+
+
+def append_history(job_msg: Dict, forget: Iterable[str] = ()):
+    """Record a finished job, & jobs by id it replaced in the history"""
+    append_history_records([{'forget': job_id} for job_id in forget] + [{'job': job_msg}])
+
+
+def append_forget(*job_ids: str):
+    """Record jobs have been removed from the history"""
+    append_history_records([{'forget': job_id} for job_id in job_ids])
 
 
 def write_history(history: List[Dict]):
-    if not os.path.exists(history_path()):
-        os.makedirs(os.path.dirname(history_path()))
-    with open(history_path(), 'w') as file:
-        file.write(yaml.safe_dump(history))
+    """Atomically replace the journal with a compacted one holding only the given jobs"""
+    flush_history()
+    with journal_lock:
+        replace_journal(history)
+
+
+def replace_journal(history: List[Dict]):
+    """Write a compacted journal & rename it over the current one, journal_lock must be held"""
+    os.makedirs(config_directory(), exist_ok=True)
+    tmp_path = history_journal_path() + '.tmp'
+    with open(tmp_path, 'w') as file:
+        for job_msg in history:
+            file.write(encode_record({'job': job_msg}))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, history_journal_path())
+
+
+def metrics_path() -> Optional[str]:
+    """Prometheus text format metrics file, ie in a node_exporter textfile directory, None => disabled"""
+    return os.environ.get('APART_GTK_METRICS_FILE') or None
+
+
+def jobs_per_device() -> int:
+    """Clone & restore jobs run at once per partition disk, more are queued"""
+    return max(1, int(os.environ.get('APART_GTK_JOBS_PER_DEVICE') or 1))
+
+
+def jobs_per_backup_device() -> Optional[int]:
+    """Clone & restore jobs run at once per disk of backup directories & image files, None => unlimited"""
+    return max(0, int(os.environ.get('APART_GTK_JOBS_PER_BACKUP_DEVICE') or 0)) or None
 
 
 def animation_duration_ms() -> int:
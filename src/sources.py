@@ -0,0 +1,45 @@
+from typing import *
+
+
+class SourceIndex:
+    """
+    Partitions of a sources message indexed by name, built once per message and shared by
+    everything interested in sources
+
+    >>> first = SourceIndex([{'name': 'sdx', 'parts': [{'name': 'sdx1', 'mounted': False},
+    ...                                                 {'name': 'sdx2', 'mounted': False}]}])
+    >>> first.part('sdx1')
+    {'name': 'sdx1', 'mounted': False}
+    >>> first.part('sdz1') is None
+    True
+    >>> first.changed is None
+    True
+
+    >>> second = SourceIndex([{'name': 'sdx', 'parts': [{'name': 'sdx1', 'mounted': True},
+    ...                                                  {'name': 'sdx2', 'mounted': False}]},
+    ...                       {'name': 'sdy', 'parts': [{'name': 'sdy1', 'mounted': False}]}],
+    ...                      previous=first)
+    >>> sorted(second.changed)
+    ['sdx1', 'sdy1']
+    >>> second.has_changed('sdx2')
+    False
+    """
+    def __init__(self, sources: List[Dict[str, Any]], previous: 'SourceIndex' = None):
+        """:param previous: index of the last sources message, to work out which partitions changed"""
+        self.sources = sources
+        self.parts = {}  # name -> part
+        for disk in sources:
+            for part in disk['parts']:
+                self.parts[part['name']] = part
+
+        self.changed = None  # Set[str] names of partitions added, removed or changed, None => all
+        if previous:
+            self.changed = set(name for name, part in self.parts.items()
+                               if previous.parts.get(name) != part)
+            self.changed.update(name for name in previous.parts if name not in self.parts)
+
+    def part(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.parts.get(name)
+
+    def has_changed(self, name: str) -> bool:
+        return self.changed is None or name in self.changed
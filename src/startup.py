@@ -0,0 +1,30 @@
+"""Timeline of startup events, printed to stderr with --profile-startup"""
+import sys
+import time
+
+STARTED = time.perf_counter()  # on first import, which app.py does before anything else
+
+enabled = False
+# marks: Dict[str, float] = {}, seconds from STARTED by event, in order of occurrence
+marks = {}
+
+
+def mark(event: str):
+    """Record the first occurrence of an event, printing it when profiling"""
+    if event in marks:
+        return
+    marks[event] = time.perf_counter() - STARTED
+    if enabled:
+        print_mark(event)
+
+
+def print_mark(event: str):
+    print('startup {:>8.1f}ms {}'.format(marks[event] * 1000, event), file=sys.stderr, flush=True)
+
+
+def enable():
+    """Print events as they happen, including those already recorded"""
+    global enabled
+    enabled = True
+    for event in marks:
+        print_mark(event)
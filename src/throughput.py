@@ -0,0 +1,140 @@
+import math
+import re
+from collections import deque
+from typing import *
+
+# recent (elapsed seconds, complete) samples kept for the rate, estimate & sparkline of a running job
+SAMPLES = 120
+# the whole job is summarised in at most twice this many points of (elapsed seconds, complete)
+CURVE_POINTS = 32
+# time constant of the exponential smoothing, larger => steadier but slower to follow real change
+SMOOTHING_SECONDS = 20.0
+# the smoothed remaining time is trusted once it has at least this many samples over this many
+# seconds, until then the core's estimate is used
+ESTIMATE_MIN_SAMPLES = 5
+ESTIMATE_MIN_SECONDS = 10.0
+
+rate_re = re.compile(r'^\s*([\d.]+)\s*([KMGTP]?)(i?)B/(s|sec|min)\s*$')
+
+
+def parse_rate(rate: Optional[str]) -> Optional[float]:
+    """
+    :return: bytes/second of a partclone rate, None if missing or unrecognised
+
+    >>> parse_rate('9.10GB/min')
+    151666666.66666666
+    >>> parse_rate('512KiB/s')
+    524288.0
+    >>> parse_rate('Initializing') is None
+    True
+    """
+    m = rate and re.fullmatch(rate_re, rate)
+    if not m:
+        return None
+    value, prefix, binary, per = m.groups()
+    scale = (1024 if binary else 1000) ** ' KMGTP'.index(prefix or ' ')
+    return float(value) * scale / (60 if per == 'min' else 1)
+
+
+def smooth(previous: Optional[float], value: float, weight: float) -> float:
+    if previous is None:
+        return value
+    return previous + weight * (value - previous)
+
+
+def curve_rates(curve: List[List[float]]) -> List[float]:
+    """
+    :return: complete/second between consecutive points of a summarised curve or samples
+
+    >>> curve_rates([[0, 0], [10, 0.2], [30, 0.4]])
+    [0.02, 0.01]
+    """
+    return [(b[1] - a[1]) / (b[0] - a[0]) for a, b in zip(curve, curve[1:]) if b[0] > a[0]]
+
+
+class Throughput:
+    """
+    Ring buffer of observed (elapsed seconds, complete) progress samples of a running job, giving
+    an exponentially smoothed complete/second & remaining time, the recent rates between samples for
+    a sparkline and a bounded summary curve of the whole job. The rate & remaining time come from the
+    observed progress rather than the core's reported rate, only the smoothed byte_rate is the core's
+
+    >>> throughput = Throughput()
+    >>> throughput.add(0, 0.0)
+    >>> throughput.add(5, 0.025, byte_rate=1000.0)
+    >>> throughput.remaining(5) is None
+    True
+    >>> for elapsed in range(10, 101, 10):
+    ...     throughput.add(elapsed, elapsed / 200, byte_rate=1000.0)
+    >>> round(throughput.fraction_rate, 4), throughput.byte_rate
+    (0.005, 1000.0)
+    >>> throughput.remaining(100)
+    100.0
+    >>> throughput.remaining(130)
+    70.0
+    >>> throughput.summary()[-1]
+    [100.0, 0.5]
+
+    >>> for elapsed in range(101, 1000):
+    ...     throughput.add(elapsed, 0.5 + (elapsed - 100) / 1800)
+    >>> rates = throughput.recent_rates()
+    >>> len(rates) == SAMPLES - 1, round(min(rates), 6), round(max(rates), 6)
+    (True, 0.000556, 0.000556)
+    >>> len(throughput.summary()) <= 2 * CURVE_POINTS + 1
+    True
+    >>> throughput.summary()[-1]
+    [999.0, 0.9994]
+    """
+    def __init__(self):
+        self.samples = deque(maxlen=SAMPLES)  # (elapsed seconds, complete) newest last
+        self.fraction_rate = None  # smoothed complete/second
+        self.byte_rate = None  # smoothed bytes/second reported by the core, for display only
+        self.curve = []  # [elapsed seconds, complete] of every curve_step-th sample
+        self.curve_step = 1
+        self.sample_count = 0
+        self.first_elapsed = None  # elapsed seconds of the first sample
+
+    def add(self, elapsed: float, fraction: float, byte_rate: float = None):
+        """:param elapsed: seconds since the job started, from a monotonic clock"""
+        elapsed = float(elapsed)
+        if self.samples:
+            last_elapsed, last_fraction = self.samples[-1]
+            interval = elapsed - last_elapsed
+            if interval <= 0:
+                return
+            weight = 1 - math.exp(-interval / SMOOTHING_SECONDS)
+            self.fraction_rate = smooth(self.fraction_rate, max(0.0, fraction - last_fraction) / interval, weight)
+            if byte_rate is not None:
+                self.byte_rate = smooth(self.byte_rate, byte_rate, weight)
+        else:
+            # a first sample only gives a baseline
+            self.first_elapsed = elapsed
+        self.samples.append((elapsed, fraction))
+
+        if self.sample_count % self.curve_step == 0:
+            self.curve.append([round(elapsed, 1), round(fraction, 4)])
+            if len(self.curve) > 2 * CURVE_POINTS:
+                self.curve = self.curve[::2]
+                self.curve_step *= 2
+        self.sample_count += 1
+
+    def remaining(self, elapsed: float) -> Optional[float]:
+        """:return: estimated seconds until complete, None => unknown or too few samples"""
+        if not self.fraction_rate or self.sample_count < ESTIMATE_MIN_SAMPLES or \
+                self.samples[-1][0] - self.first_elapsed < ESTIMATE_MIN_SECONDS:
+            return None
+        last_elapsed, last_fraction = self.samples[-1]
+        return max(0.0, (1 - last_fraction) / self.fraction_rate - (elapsed - last_elapsed))
+
+    def recent_rates(self) -> List[float]:
+        """:return: observed complete/second between the buffered samples, as of a history curve"""
+        return curve_rates(list(self.samples))
+
+    def summary(self) -> List[List[float]]:
+        """:return: [elapsed seconds, complete] points of the whole job, including the newest"""
+        if not self.samples:
+            return []
+        newest = [round(self.samples[-1][0], 1), round(self.samples[-1][1], 4)]
+        if self.curve and self.curve[-1] == newest:
+            return list(self.curve)
+        return self.curve + [newest]
@@ -5,6 +5,9 @@ from typing import *
 filename_re = re.compile(r"/[^/]+$")
 name_re = re.compile(r"^.*/(([^/]+)-\d{4,}-\d\d-\d\dT\d{4}\.apt\..+\.(.+))$")
 source_re = re.compile(r"^/dev/")
+# message keys holding timestamps, needing conversion when not decoded from yaml
+TIMESTAMP_KEYS = frozenset(['start', 'finish', 'estimated_finish'])
+timestamp_re = re.compile(r"^(\d{4}-\d\d-\d\d)[Tt ](\d\d:\d\d:\d\d)(?:\.(\d+))?\s*(Z|z|[+-]\d\d:?\d\d)?$")
 
 
 def extract_directory(path: str) -> str:
@@ -48,6 +51,56 @@ def extract_compression_option(path: str) -> str:
     return z_option
 
 
+# compression option -> (min level, max level, default level)
+COMPRESSION_LEVELS = {'gz': (1, 9, 6), 'lz4': (1, 12, 1), 'zst': (1, 19, 3)}
+# compression options with multi-threaded compressors, pigz -p & zstd -T
+THREADED_COMPRESSION = frozenset(['gz', 'zst'])
+# clone request keys only sent to cores advertising them in the started status clone_options
+COMPRESSION_SETTINGS = ('compression_level', 'compression_threads')
+
+
+def compression_settings(msg: Dict) -> Dict[str, int]:
+    """
+    Non-default compression level & threads of a clone message
+
+    >>> compression_settings({'type': 'clone', 'compression_level': 19, 'compression_threads': 32})
+    {'compression_level': 19, 'compression_threads': 32}
+    >>> compression_settings({'type': 'clone'})
+    {}
+    """
+    return {key: msg[key] for key in COMPRESSION_SETTINGS if msg.get(key)}
+
+
+def describe_compression(z_option: str, settings: Dict[str, int]) -> str:
+    """
+    >>> describe_compression('zst', {'compression_level': 19, 'compression_threads': 32})
+    'zst level 19, 32 threads'
+    >>> describe_compression('gz', {})
+    'gz default level'
+    """
+    description = '{} level {}'.format(z_option, settings['compression_level']) \
+        if settings.get('compression_level') else '{} default level'.format(z_option)
+    if settings.get('compression_threads'):
+        description += ', {} threads'.format(settings['compression_threads'])
+    return description
+
+
+def preferred_compression(z_options: List[str]) -> Optional[str]:
+    """
+    Default compression of new clones
+    >>> preferred_compression(['uncompressed', 'gz', 'lz4', 'zst'])
+    'zst'
+    >>> preferred_compression(['uncompressed', 'lz4'])
+    'lz4'
+    >>> preferred_compression([]) is None
+    True
+    """
+    for z_option in ['zst', 'gz', 'lz4']:
+        if z_option in z_options:
+            return z_option
+    return z_options[0] if z_options else None
+
+
 def rm_dev(source: str) -> str:
     """
     >>> rm_dev("/dev/sda1")
@@ -64,6 +117,71 @@ def round_to_second(delta: timedelta) -> timedelta:
     return truncated
 
 
+def parse_timestamp(text: str) -> datetime:
+    """
+    Parse an ISO-8601 timestamp as sent by apart-core, defaulting to UTC when the tz is missing
+
+    >>> parse_timestamp('2017-05-03T10:20:30.123456789Z')
+    datetime.datetime(2017, 5, 3, 10, 20, 30, 123456, tzinfo=datetime.timezone.utc)
+
+    >>> parse_timestamp('2017-05-03T10:20:30+01:00')
+    datetime.datetime(2017, 5, 3, 10, 20, 30, tzinfo=datetime.timezone(datetime.timedelta(seconds=3600)))
+
+    >>> parse_timestamp('2017-05-03 10:20:30.5')
+    datetime.datetime(2017, 5, 3, 10, 20, 30, 500000, tzinfo=datetime.timezone.utc)
+    """
+    m = re.fullmatch(timestamp_re, text)
+    if not m:
+        raise ValueError('Invalid timestamp: ' + text)
+    date, time, fraction, tz = m.groups()
+    parsed = datetime.strptime(date + 'T' + time, '%Y-%m-%dT%H:%M:%S')
+    if fraction:
+        parsed = parsed.replace(microsecond=int(fraction[:6].ljust(6, '0')))
+    if not tz or tz in ['Z', 'z']:
+        return parsed.replace(tzinfo=timezone.utc)
+    offset = timedelta(hours=int(tz[1:3]), minutes=int(tz[-2:]))
+    return parsed.replace(tzinfo=timezone(-offset if tz[0] == '-' else offset))
+
+
+def parse_timestamps(values: Dict) -> Dict:
+    """
+    Parse timestamp strings of TIMESTAMP_KEYS in place
+
+    >>> parse_timestamps({'id': 'a', 'finish': '2017-05-03T10:20:30Z'})
+    {'id': 'a', 'finish': datetime.datetime(2017, 5, 3, 10, 20, 30, tzinfo=datetime.timezone.utc)}
+    """
+    for key in TIMESTAMP_KEYS.intersection(values):
+        if isinstance(values[key], str):
+            values[key] = parse_timestamp(values[key])
+    return values
+
+
+def next_naturaltime_change(delta: timedelta) -> timedelta:
+    """
+    :return: time until the humanized text of an elapsed delta may next change,
+             ie "3 minutes ago" changes on minute boundaries, "3 hours ago" on hour boundaries
+
+    >>> next_naturaltime_change(timedelta(seconds=20))
+    datetime.timedelta(seconds=40)
+
+    >>> next_naturaltime_change(timedelta(minutes=5, seconds=10))
+    datetime.timedelta(seconds=50)
+
+    >>> next_naturaltime_change(timedelta(hours=3, minutes=20))
+    datetime.timedelta(seconds=2400)
+
+    >>> next_naturaltime_change(timedelta(days=3, hours=1))
+    datetime.timedelta(seconds=82800)
+    """
+    if delta < timedelta(hours=1):
+        unit = timedelta(minutes=1)
+    elif delta < timedelta(days=1):
+        unit = timedelta(hours=1)
+    else:
+        unit = timedelta(days=1)
+    return unit - delta % unit
+
+
 def default_datetime_to_utc(message):
     """Recursively add UTC as tz when missing, pyyaml seems to ignore yaml datetime 'Z' endings"""
     def handle(val, setter: Callable):
@@ -0,0 +1,2 @@
+# App versions, "major.minor", major => new stuff, minor => fixes
+__version__ = '0.29'
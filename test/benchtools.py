@@ -0,0 +1,61 @@
+"""Fixtures shared by the benchmark scripts in this directory"""
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def fake_history(entries: int, partitions: int = 4):
+    """
+    Successful clones of partitions sda1.. finishing 37 minutes apart until now, their source uuids
+    match the partitions of the first test/mockcore disk
+    """
+    finish = datetime.now(timezone.utc) - timedelta(minutes=37 * entries)
+    for n in range(entries):
+        finish += timedelta(minutes=37)
+        yield {'type': 'clone',
+               'id': str(uuid.uuid4()),
+               'source': '/dev/sda{}'.format(n % partitions + 1),
+               'source_uuid': '0-{}'.format(n % partitions + 1),
+               'destination': '/mnt/backups/part{}-{:%Y-%m-%dT%H%M}.apt.ext4.zst'.format(n % partitions + 1,
+                                                                                         finish),
+               'start': finish - timedelta(minutes=12, seconds=n % 60),
+               'finish': finish,
+               'complete': 1.0,
+               'image_size': 1234567890 + n}
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    """
+    >>> percentile([1, 2, 3, 4], 0.5), percentile([1, 2, 3, 4], 0.99), percentile([], 0.5)
+    (2, 4, 0)
+    """
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))] if ordered else 0
+
+
+@contextmanager
+def temporary_config_directory():
+    """Point APART_GTK_CONFIG_DIR at a new temporary directory, restoring it on exit"""
+    previous = os.environ.get('APART_GTK_CONFIG_DIR')
+    with tempfile.TemporaryDirectory() as config_dir:
+        os.environ['APART_GTK_CONFIG_DIR'] = config_dir
+        try:
+            yield config_dir
+        finally:
+            if previous is None:
+                del os.environ['APART_GTK_CONFIG_DIR']
+            else:
+                os.environ['APART_GTK_CONFIG_DIR'] = previous
+
+
+def mock_core_env(env: dict, config_dir: str, core_opts: str) -> dict:
+    """:return: env running apart-gtk against test/mockcore with its config in config_dir"""
+    return dict(env,
+                APART_GTK_CONFIG_DIR=config_dir,
+                APART_GTK_CORE_CMD=os.path.join(TEST_DIR, 'mockcore'),
+                APART_MOCK_CORE_OPTS=core_opts,
+                # any partclone override runs the core directly rather than through pkexec
+                APART_PARTCLONE_CMD=os.path.join(TEST_DIR, 'mockpcl'))